@@ -1,17 +1,42 @@
-from flask import Flask, request, render_template, redirect, url_for, flash, session
-import sqlite3
+from flask import Flask, Response, g, jsonify, request, render_template, redirect, url_for, flash, session, stream_with_context
 import os
-import hashlib
+import bulk_verify
+import chain_storage
+import db_pool
+import file_hashing
 from werkzeug.utils import secure_filename
 
 app = Flask(__name__)
 app.secret_key = 'secret_key'
 UPLOAD_FOLDER = 'uploads/'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Keep a copy of uploaded barcodes in UPLOAD_FOLDER (False hashes them without touching disk)
+app.config['STORE_UPLOADS'] = True
+app.config['DB_PATH'] = 'app.db'
+# Connections kept open in the pool (shared with the SQLite chain store)
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', db_pool.DEFAULT_POOL_SIZE))
+
+def get_pool():
+    return db_pool.get_pool(app.config['DB_PATH'], app.config['DB_POOL_SIZE'])
+
+# One pooled connection per request, reused by every query in it
+def get_db():
+    if 'db' not in g:
+        g.db = get_pool().acquire()
+    return g.db
+
+@app.teardown_appcontext
+def release_db(exception):
+    conn = g.pop('db', None)
+    if conn is not None:
+        get_pool().release(conn)
 
 # Create database
 def init_db():
-    conn = sqlite3.connect('app.db')
+    with get_pool().connection() as conn:
+        create_tables(conn)
+
+def create_tables(conn):
     cursor = conn.cursor()
     # Create tables
     cursor.execute('''
@@ -30,6 +55,8 @@ def init_db():
             barcode_hash TEXT
         )
     ''')
+    # Verification looks products up by barcode hash
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_barcode_hash ON products (barcode_hash)')
     # Add sample users
     cursor.execute('''
         INSERT OR IGNORE INTO users (username, password, role) VALUES 
@@ -37,15 +64,19 @@ def init_db():
         ('user', 'user123', 'user')
     ''')
     conn.commit()
-    conn.close()
+    # Shared chain tables, filled by the Streamlit apps when CHAIN_STORAGE=sqlite
+    conn.executescript(chain_storage.SCHEMA)
 
 # Hash a file for barcode verification
 def hash_file(file_path):
-    hasher = hashlib.sha256()
-    with open(file_path, 'rb') as f:
-        buf = f.read()
-        hasher.update(buf)
-    return hasher.hexdigest()
+    return file_hashing.hash_path(file_path)
+
+# Hash an uploaded barcode while storing it, in a single pass over the stream
+def hash_upload(barcode):
+    barcode_path = None
+    if app.config['STORE_UPLOADS']:
+        barcode_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(barcode.filename))
+    return file_hashing.hash_upload(barcode.stream, barcode_path)
 
 @app.route('/')
 def home():
@@ -55,11 +86,9 @@ def home():
 def login():
     username = request.form['username']
     password = request.form['password']
-    conn = sqlite3.connect('app.db')
-    cursor = conn.cursor()
+    cursor = get_db().cursor()
     cursor.execute('SELECT * FROM users WHERE username = ? AND password = ?', (username, password))
     user = cursor.fetchone()
-    conn.close()
     if user:
         session['username'] = user[1]
         session['role'] = user[3]
@@ -79,17 +108,14 @@ def manufacturer():
             details = request.form['details']
             barcode = request.files['barcode']
             if barcode:
-                barcode_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(barcode.filename))
-                barcode.save(barcode_path)
-                barcode_hash = hash_file(barcode_path)
+                barcode_hash = hash_upload(barcode)
 
                 # Save product details to DB
-                conn = sqlite3.connect('app.db')
+                conn = get_db()
                 cursor = conn.cursor()
                 cursor.execute('INSERT INTO products (product_name, details, barcode_hash) VALUES (?, ?, ?)',
                                (product_name, details, barcode_hash))
                 conn.commit()
-                conn.close()
                 flash('Product added successfully')
                 return redirect(url_for('manufacturer'))
         return render_template('manufacturer.html')
@@ -102,18 +128,19 @@ def user():
         if request.method == 'POST':
             barcode = request.files['barcode']
             if barcode:
-                barcode_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(barcode.filename))
-                barcode.save(barcode_path)
-                barcode_hash = hash_file(barcode_path)
+                barcode_hash = hash_upload(barcode)
 
                 # Verify barcode
-                conn = sqlite3.connect('app.db')
+                conn = get_db()
                 cursor = conn.cursor()
                 cursor.execute('SELECT * FROM products WHERE barcode_hash = ?', (barcode_hash,))
                 product = cursor.fetchone()
-                conn.close()
+                # Fall back to products registered on the shared chain store
+                chain_product = None if product else chain_storage.lookup_products(conn, [barcode_hash]).get(barcode_hash)
                 if product:
                     flash(f'Product Verified: {product[1]}, Details: {product[2]}')
+                elif chain_product:
+                    flash(f'Product Verified: {chain_product["product_name"]}, Manufacturer: {chain_product["manufacturer_name"]}')
                 else:
                     flash('Counterfeit Product Detected!')
                 return redirect(url_for('user'))
@@ -121,6 +148,51 @@ def user():
     else:
         return redirect(url_for('home'))
 
+# Look up many barcode hashes with one query per chunk
+def resolve_products(barcode_hashes):
+    if not barcode_hashes:
+        return {}
+    conn = get_db()
+    cursor = conn.cursor()
+    placeholders = ','.join('?' * len(barcode_hashes))
+    cursor.execute(f'SELECT barcode_hash, product_name, details FROM products WHERE barcode_hash IN ({placeholders})',
+                   barcode_hashes)
+    found = {row[0]: {'product_name': row[1], 'details': row[2]} for row in cursor.fetchall()}
+    missing = [barcode_hash for barcode_hash in barcode_hashes if barcode_hash not in found]
+    for barcode_hash, product in chain_storage.lookup_products(conn, missing).items():
+        found[barcode_hash] = {'product_name': product['product_name'], 'details': product['manufacturer_name']}
+    return found
+
+# Batch verification for retailers: many barcode files, or a list of
+# precomputed SHA-256 hashes (form field "hashes" or a JSON list).
+# Results are streamed per item as CSV (default) or JSON lines (?format=json).
+@app.route('/user/batch', methods=['POST'])
+def user_batch():
+    if 'role' in session and session['role'] == 'user':
+        barcodes = [barcode for barcode in request.files.getlist('barcodes') if barcode]
+        if barcodes:
+            items = bulk_verify.hash_files([(barcode.filename, barcode.stream) for barcode in barcodes])
+        else:
+            hashes = request.get_json(silent=True) or request.form.get('hashes', '').split()
+            items = bulk_verify.hash_list(hashes)
+
+        fmt = 'json' if request.args.get('format') == 'json' else 'csv'
+        results = bulk_verify.verify_items(items, resolve_products)
+        body = bulk_verify.stream_results(results, fmt, ['item', 'barcode_hash', 'status', 'product_name', 'details'])
+        mimetype = 'application/x-ndjson' if fmt == 'json' else 'text/csv'
+        return Response(stream_with_context(body), mimetype=mimetype)
+    else:
+        return redirect(url_for('home'))
+
+# Connection pool metrics (size, connections in use, waits, timeouts).
+# They include the database path, so only manufacturer accounts can see them.
+@app.route('/metrics/db')
+def db_metrics():
+    if 'role' in session and session['role'] == 'manufacturer':
+        return jsonify(db_pool.all_metrics())
+    else:
+        return redirect(url_for('home'))
+
 @app.route('/logout')
 def logout():
     session.clear()
@@ -3,8 +3,16 @@ import hashlib
 import time
 import json
 import os
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
+import block_batcher
+import bulk_import
+import bulk_verify
+import file_hashing
+import pdf_export
+import chain_cache
+import chart_cache
+import chain_explorer
+import chain_index
+import user_store
 from io import BytesIO
 import networkx as nx
 import pandas as pd
@@ -15,123 +23,122 @@ BLOCKCHAIN_FILE = "blockchain.json"
 USERS_FILE = "users.json"
 ROLES_FILE = "roles.json"
 
+# Products per block and the longest a queued product waits before its block is sealed
+BLOCK_CAPACITY = 31
+BLOCK_MAX_WAIT = 5.0
+
 # Set page configuration as the first Streamlit command
 st.set_page_config(page_title="Login System", layout="wide")
 
-# Blockchain setup
+# Blockchain setup: one chain per process, shared by every session and rerun
+shared_chain = chain_cache.get_shared_chain(BLOCKCHAIN_FILE)
+# Block log or SQLite, picked with the CHAIN_STORAGE environment variable
+chain_store = shared_chain.store
 blockchain = []
+barcode_index = None
+search_index = None
+product_batcher = block_batcher.get_batcher(chain_store, BLOCK_CAPACITY, BLOCK_MAX_WAIT)
 
 # Initialize the blockchain with a genesis block
 def initialize_blockchain():
-    global blockchain
-    if not blockchain:
-        if os.path.exists(BLOCKCHAIN_FILE):
-            # Load blockchain data from file if it exists
-            with open(BLOCKCHAIN_FILE, 'r') as f:
-                blockchain = json.load(f)
-        else:
-            # Create a genesis block if no file exists
-            genesis_block = {
-                "index": 0,
-                "timestamp": time.time(),
-                "product_details": [],
-                "previous_hash": "0",
-                "hash": "genesis_block"
-            }
-            blockchain.append(genesis_block)
+    global blockchain, barcode_index, search_index
+    # Reuses the cached chain and indexes; reloads only if the store changed on disk
+    shared_chain.refresh()
+    blockchain = shared_chain.blockchain
+    barcode_index = shared_chain.barcode_index
+    search_index = shared_chain.get_search_index()
+    # Sealed blocks land on the shared chain; queuing and sealing hold its write lock
+    product_batcher.attach(blockchain, shared_chain.committed, shared_chain)
 
 # Hashing utility functions
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
+# Streams the upload into SHA-256 without copying it
 def hash_file(file):
-    file.seek(0)  # Ensure the file pointer is at the beginning
-    return hashlib.sha256(file.read()).hexdigest()
-
-def hash_block(block):
-    block_string = f"{block['index']}{block['timestamp']}{block['product_details']}{block['previous_hash']}"
-    return hashlib.sha256(block_string.encode()).hexdigest()
+    return file_hashing.hash_file(file)
 
 def add_block(product_details, barcode_hash):
-    global blockchain
-    
-    # Check if the barcode already exists in the blockchain
-    if verify_barcode_in_blockchain(barcode_hash):
+    # Check if the barcode already exists in the blockchain or is queued for
+    # the next block, and queue it, under the chain's write lock so no other
+    # session or process can register it in between
+    with shared_chain.writing():
+        duplicate = verify_barcode_in_blockchain(barcode_hash) or product_batcher.is_pending(barcode_hash)
+        if not duplicate:
+            # A block is sealed (hashed and written once) when it holds
+            # BLOCK_CAPACITY products or BLOCK_MAX_WAIT seconds have passed
+            sealed_blocks = product_batcher.submit(product_details, barcode_hash)
+    if duplicate:
         st.error(f"Product with Barcode Hash: {barcode_hash} already exists in the blockchain.")
         return
 
-    # Check if the current block is full (31 products)
-    current_block = blockchain[-1]
-    if len(current_block['product_details']) < 2:
-        # Add product to the current block
-        current_block['product_details'].append({"product": product_details, "barcode_hash": barcode_hash})
-        # Recalculate the current block's hash
-        current_block["hash"] = hash_block(current_block)
-        
-        # Save the updated blockchain to file
-        with open(BLOCKCHAIN_FILE, 'w') as f:
-            json.dump(blockchain, f)
-        
-        st.success(f"Product added successfully with Barcode Hash: {barcode_hash}")
+    if sealed_blocks:
+        st.success(f"Block is full! Block {sealed_blocks[-1]['index']} sealed with product Barcode Hash: {barcode_hash}")
     else:
-        # If block is full, create a new block
-        previous_block = blockchain[-1]
-        new_block = {
-            "index": len(blockchain),
-            "timestamp": time.time(),
-            "product_details": [{"product": product_details, "barcode_hash": barcode_hash}],
-            "previous_hash": previous_block["hash"],
-            "hash": "temporary_placeholder"
-        }
-        new_block["hash"] = hash_block(new_block)
-        blockchain.append(new_block)
-        
-        # Save the updated blockchain to file
-        with open(BLOCKCHAIN_FILE, 'w') as f:
-            json.dump(blockchain, f)
-        
-        st.success(f"Block is full! New block created and product added with Barcode Hash: {barcode_hash}")
+        # Not on the chain until its block is sealed
+        st.info(f"Product with Barcode Hash: {barcode_hash} is queued and will be registered when its block "
+                f"is sealed (within {BLOCK_MAX_WAIT:g}s or once {BLOCK_CAPACITY} products are queued).")
+
+# Bulk registration of (product_details, barcode_hash) pairs.
+# Duplicates are skipped; returns the accepted products.
+def add_products(products):
+    accepted = []
+    seen = set()
+    with shared_chain.writing():
+        for product_details, barcode_hash in products:
+            if barcode_hash in seen or verify_barcode_in_blockchain(barcode_hash) or product_batcher.is_pending(barcode_hash):
+                continue
+            seen.add(barcode_hash)
+            accepted.append((product_details, barcode_hash))
+        product_batcher.submit_many(accepted)
+        return accepted
 
 def verify_barcode_in_blockchain(barcode_hash):
-    for block in blockchain:
-        for product in block["product_details"]:
-            if product["barcode_hash"] == barcode_hash:
-                return True
-    return False
+    # The Bloom filter rules out unregistered barcodes before the index is consulted
+    return shared_chain.contains_barcode(barcode_hash)
 
 
 # PDF Generation
 def generate_blockchain_pdf(blockchain_data):
-    buffer = BytesIO()
-    c = canvas.Canvas(buffer, pagesize=letter)
-    width, height = letter
-    c.setFont("Helvetica", 12)
-    
-    y = height - 50  # Start near the top of the page
-    c.drawString(50, y, "Blockchain Data")
-    y -= 20
-
-    for block in blockchain_data:
-        for product in block['product_details']:
-            product_name = product['product']['product_name']
-            manufacturer_name = product['product']['manufacturer_name']
-            barcode_hash = product['barcode_hash']
-
-            # Display product details in PDF
-            c.drawString(50, y, f"Product Name: {product_name}")
-            y -= 15
-            c.drawString(50, y, f"Manufacturer: {manufacturer_name}")
-            y -= 15
-            c.drawString(50, y, f"Barcode Hash: {barcode_hash}")
-            y -= 20
-
-            if y < 50:  # Start a new page if space runs out
-                c.showPage()
-                y = height - 50
-
-    c.save()
-    buffer.seek(0)
-    return buffer
+    # Served from the export cache: unchanged chains aren't rendered again and
+    # new blocks only add their own pages
+    stats = pdf_export.export_to_file(blockchain_data, pdf_export.export_path(chain=BLOCKCHAIN_FILE))
+    with open(stats["path"], 'rb') as f:
+        return BytesIO(f.read())
+
+# PDF export in a background worker; the download is offered once the file is ready
+def pdf_export_controls(key):
+    session = st.session_state
+    job_key = f"pdf_export_{key}"
+    with st.expander("Download Blockchain as PDF"):
+        manufacturer = st.text_input("Manufacturer (optional)", key=f"{job_key}_manufacturer")
+        start = st.number_input("From block", min_value=0, value=0, step=1, key=f"{job_key}_start")
+        stop = st.number_input("To block (0 = last)", min_value=0, value=0, step=1, key=f"{job_key}_stop")
+        if st.button("Export PDF", key=f"{job_key}_run"):
+            session[job_key] = pdf_export.export_in_background(
+                blockchain, manufacturer=manufacturer or None, start=int(start), stop=int(stop) or None,
+                chain=BLOCKCHAIN_FILE)
+
+        job = session.get(job_key)
+        if job is None:
+            return
+        if not job.done():
+            st.info("Exporting...")
+            st.button("Check again", key=f"{job_key}_poll")
+        elif job.exception() is not None:
+            st.error(f"Export failed: {job.exception()}")
+        else:
+            stats = job.result()
+            st.caption(f"{stats['products']} products on {stats['pages']} pages, {stats['pages_rendered']} rendered "
+                       f"({stats['cache']}) in {stats['seconds']:.2f}s")
+            with open(stats["path"], 'rb') as f:
+                st.download_button(
+                    label="Download Blockchain PDF",
+                    data=f,
+                    file_name=os.path.basename(stats["path"]),
+                    mime="application/pdf",
+                    key=f"{job_key}_download"
+                )
 
 # Authentication
 def login(username, password):
@@ -141,20 +148,11 @@ def login(username, password):
         return True
     return False
 
-def load_users():
-    if os.path.exists(USERS_FILE):
-        with open(USERS_FILE, 'r') as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError as e:
-                print(f"Error loading JSON: {e}")
-                return {}
-    return {}
-
+# Accounts are cached for the whole process and re-read only when users.json changes
+account_store = user_store.get_user_store(USERS_FILE)
 
-def save_users(users):
-    with open(USERS_FILE, 'w') as f:
-        json.dump(users, f)
+def load_users():
+    return account_store.all()
 
 
 def load_roles():
@@ -164,23 +162,20 @@ def load_roles():
     return {}
 
 def login(username, password):
-    users = load_users()
+    user = account_store.get(username)
 
     # Check if username exists and password matches
-    if username in users:
+    if user is not None:
         hashed_password = hash_password(password)
-        if users[username]["password"] == hashed_password:
-            return users[username]["role"]
+        if user["password"] == hashed_password:
+            return user["role"]
     return None
     
 
 def create_account(username, password, role):
-    users = load_users()
-
-    if username not in users:
-        hashed_password = hash_password(password)
-        users[username] = {"password": hashed_password, "role": role}
-        save_users(users)
+    hashed_password = hash_password(password)
+    # Checks and appends under a lock, so concurrent sign-ups can't overwrite each other
+    if account_store.create(username, {"password": hashed_password, "role": role}):
         st.success(f"Account created successfully for username '{username}'!")
     else:
         st.error("Username already exists. Please choose a different username.")
@@ -207,14 +202,29 @@ def manufacturer_dashboard():
                 st.error("Please fill in all the fields and upload a barcode file.")
     with col2:
         # Button to download blockchain as a PDF
-        if st.button("Download Blockchain as PDF"):
-            pdf_buffer = generate_blockchain_pdf(blockchain)
-            st.download_button(
-                label="Download Blockchain PDF",
-                data=pdf_buffer,
-                file_name="blockchain_data.pdf",
-                mime="application/pdf"
-            )
+        pdf_export_controls(session.role)
+
+    # Bulk import of a whole catalogue: manifest + zip of barcode files
+    with st.expander("Bulk Import"):
+        st.write("Manifest columns: product_name, manufacturer_name, barcode_file (a file name inside the zip).")
+        manifest_file = st.file_uploader("Product Manifest", type=["csv", "parquet"])
+        barcodes_zip = st.file_uploader("Barcode Files (zip)", type=["zip"])
+        if st.button("Import Products"):
+            if manifest_file and barcodes_zip:
+                status = st.empty()
+
+                def report(stats):
+                    status.write(f"{stats['rows']} rows processed, {stats['imported']} imported, "
+                                 f"{stats['duplicates']} duplicates, {stats['missing']} missing files "
+                                 f"({stats['rows_per_sec']:.0f} rows/sec)")
+
+                stats = bulk_import.import_products(manifest_file, barcodes_zip, add_products,
+                                                    verify_barcode_in_blockchain, progress=report)
+                # Seal the last partially filled block right away
+                product_batcher.flush()
+                st.success(f"Imported {stats['imported']} products in {stats['seconds']:.1f}s.")
+            else:
+                st.error("Please upload a manifest and a zip of barcode files.")
 
     if st.button("Logout"):
         session.logged_in = False
@@ -236,32 +246,17 @@ def user_dashboard():
     with col1:
         # Search section for User Dashboard
         search_type = st.radio("Search by", ["Manufacturer Name", "Product Name"])
+        match_type = st.radio("Match", ["Exact", "Case-insensitive", "Prefix"], horizontal=True)
 
         search_term = st.text_input(f"Enter {search_type}")
         if st.button("Search"):
             if search_term:
-                found = False
-                search_results = []
-                for block in blockchain:
-                    for product in block["product_details"]:
-                        if search_type == "Manufacturer Name" and product["product"]["manufacturer_name"] == search_term:
-                            search_results.append({
-                                "Product Name": product['product']['product_name'],
-                                "Manufacturer": product['product']['manufacturer_name'],
-                                "Barcode Hash": product['barcode_hash']
-                            })
-                            found = True
-                        elif search_type == "Product Name" and product["product"]["product_name"] == search_term:
-                            search_results.append({
-                                "Product Name": product['product']['product_name'],
-                                "Manufacturer": product['product']['manufacturer_name'],
-                                "Barcode Hash": product['barcode_hash']
-                            })
-                            found = True
-
-                if found:
+                # Look the term up in the secondary index instead of scanning the chain
+                search_results = search_index.search(search_type, search_term, match_type)
+
+                if search_results:
                     st.write("Search Results:")
-                    st.dataframe(pd.DataFrame(search_results))
+                    st.dataframe(pd.DataFrame(search_results, columns=chain_index.SEARCH_COLUMNS))
                 else:
                     st.error(f"No product found with {search_type}: {search_term}")
             else:
@@ -269,14 +264,7 @@ def user_dashboard():
         
     with col2:
         # Button to download blockchain as a PDF
-        if st.button("Download Blockchain as PDF"):
-            pdf_buffer = generate_blockchain_pdf(blockchain)
-            st.download_button(
-                label="Download Blockchain PDF",
-                data=pdf_buffer,
-                file_name="blockchain_data.pdf",
-                mime="application/pdf"
-            )
+        pdf_export_controls(session.role)
     
     barcode_file = st.file_uploader("Upload Barcode to Verify", type=["png", "jpg", "jpeg", "pdf", "txt"])
     if barcode_file:
@@ -287,6 +275,23 @@ def user_dashboard():
             st.success("Barcode is available in the blockchain!")
         else:
             st.error("Barcode is not available in the blockchain.")
+
+    # Batch verification of a whole shipment
+    shipment_files = st.file_uploader("Upload Shipment Barcodes to Verify", type=["png", "jpg", "jpeg", "pdf", "txt"],
+                                      accept_multiple_files=True)
+    if shipment_files:
+        started = time.perf_counter()
+        items = bulk_verify.hash_files([(shipment_file.name, shipment_file) for shipment_file in shipment_files])
+        results = list(bulk_verify.verify_items(items, bulk_verify.chain_resolver(blockchain, barcode_index)))
+        verified = sum(result["status"] == "verified" for result in results)
+        st.write(f"{verified} of {len(results)} barcodes verified in {time.perf_counter() - started:.2f}s.")
+        st.dataframe(pd.DataFrame(results, columns=bulk_verify.RESULT_FIELDS))
+        st.download_button(
+            label="Download Verification Results",
+            data="".join(bulk_verify.stream_results(results)),
+            file_name="verification_results.csv",
+            mime="text/csv"
+        )
     
     # Logout button for User Dashboard
     if st.button("Logout"):
@@ -299,9 +304,9 @@ def user_dashboard():
 # Analytics function
 def show_analytics():
      # Calculate blockchain analytics
-    product_count = sum(len(block['product_details']) for block in blockchain)
-    manufacturers = [product['product']['manufacturer_name'] for block in blockchain for product in block['product_details']]
-    unique_barcodes = set(product['barcode_hash'] for block in blockchain for product in block['product_details'])
+    # Running aggregates kept up to date by add_block, nothing is recounted here
+    summary = shared_chain.analytics.summary()
+    product_count = summary["product_count"]
     
     
     # Check if there are products in the blockchain
@@ -310,54 +315,61 @@ def show_analytics():
         return
 
     # Find the most frequent manufacturer
-    most_frequent_manufacturer = pd.Series(manufacturers).mode()[0]
+    most_frequent_manufacturer = summary["most_frequent_manufacturer"]
     
     st.subheader("Blockchain Analytics")
     st.write(f"Product Count: {product_count}")
     st.write(f"Most Frequent Manufacturer: {most_frequent_manufacturer}")
-    st.write(f"Unique Barcodes: {len(unique_barcodes)}")
+    st.write(f"Unique Barcodes: {summary['unique_barcodes']}")
     
     # Visualizations for Blockchain Analytics
     st.subheader("Blockchain Analytics Visualization")
     
     # Bar chart for product count per manufacturer
-    manufacturer_counts = pd.Series(manufacturers).value_counts()
+    manufacturer_counts = chart_cache.get_chart("manufacturer_counts", summary["version"],
+        lambda: pd.Series(summary["manufacturer_counts"]).sort_values(ascending=False))
     st.bar_chart(manufacturer_counts)
     
-    # Line chart for product count over time (using timestamp as index)
-    timestamps = [block['timestamp'] for block in blockchain]
-    product_counts_over_time = [len(block['product_details']) for block in blockchain]
-    df = pd.DataFrame({'Timestamp': timestamps, 'Product Count': product_counts_over_time})
-    df = df.sort_values(by='Timestamp')
+    # Line chart for product count over time (products added per time bucket,
+    # bucket width picked so the chart never has more than a few hundred points)
+    df = pd.DataFrame(summary["time_buckets"], columns=['Timestamp', 'Product Count'])
     st.line_chart(df.set_index('Timestamp')['Product Count'])
     
     # Pie chart for distribution of product counts across manufacturers
-    manufacturer_distribution = manufacturer_counts.head(10)  # Top 10 manufacturers
+    manufacturer_distribution = pd.Series(dict(summary["top_manufacturers"]))  # Top 10 manufacturers
     st.write("Top 10 Manufacturers Distribution")
     st.write(manufacturer_distribution)
     
-    # Pie chart for the manufacturer distribution
-    fig, ax = plt.subplots()
-    ax.pie(manufacturer_distribution, labels=manufacturer_distribution.index, autopct='%1.1f%%', startangle=90)
-    ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
-    st.pyplot(fig)
+    # Pie chart for the manufacturer distribution, rendered once per aggregate version
+    def draw_pie():
+        fig, ax = plt.subplots()
+        ax.pie(manufacturer_distribution, labels=manufacturer_distribution.index, autopct='%1.1f%%', startangle=90)
+        ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
+        return chart_cache.figure_png(fig)
+    st.image(chart_cache.get_chart("manufacturer_pie", summary["version"], draw_pie))
 
     
 def visualize_blockchain():
     st.subheader("Blockchain Visualization")
     st.write("Visualizing the blockchain with a matrix-style block representation.")
     
-    # Load blockchain data from the JSON file
-    if os.path.exists(BLOCKCHAIN_FILE):
-        with open(BLOCKCHAIN_FILE, 'r') as f:
-            blockchain = json.load(f)
-    else:
-        st.error("Blockchain file not found.")
-        return
+    # Filters run server-side; only the selected page of blocks is read from the store
+    explorer = chain_explorer.get_explorer(chain_store)
+    col1, col2, col3 = st.columns(3)
+    block_filter = col1.text_input("Block Index")
+    hash_prefix = col2.text_input("Hash Prefix").strip()
+    manufacturer = col3.text_input("Manufacturer").strip()
+    col1, col2 = st.columns(2)
+    page_size = col1.selectbox("Blocks per Page", [10, 20, 50, 100], index=1)
+    page_number = col2.number_input("Page", min_value=1, value=1, step=1)
+
+    block_index = int(block_filter) if block_filter.strip().isdigit() else None
+    result = explorer.page(int(page_number) - 1, page_size, block_index, hash_prefix or None, manufacturer or None)
+    st.caption(f"{result['total']} matching blocks, page {result['page'] + 1} of {result['pages']}")
     
     # Prepare data for the table
     block_data = []
-    for block in blockchain:
+    for block in result['blocks']:
         block_index = block['index']
         block_hash = block['hash']
         previous_hash = block['previous_hash']
@@ -366,6 +378,8 @@ def visualize_blockchain():
         for product in block['product_details']:
             product_name = product['product']['product_name']
             product_category = product['product']['manufacturer_name']  # Handling missing categories
+            if manufacturer and product_category != manufacturer:
+                continue
             
             # Append block data to the list
             block_data.append([block_index, block_hash, previous_hash, product_name, product_category])
@@ -0,0 +1,255 @@
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: updates are only serialized within one process
+    fcntl = None
+
+import chain_model
+
+# Persisted Bloom filter over registered barcode hashes
+#
+# Most counterfeit scans are for hashes that were never registered. A
+# BarcodeFilter answers "definitely not registered" for nearly all of them
+# from k bit tests, before the barcode index or the store is consulted; a
+# "maybe" is confirmed by the index as before. There are no false negatives.
+#
+# The filter is a file: a fixed 128-byte header (parameters, number of
+# barcodes added, the blocks covered and the hash of the last one) followed
+# by the bit array, mapped read/write so the bits are shared with every
+# process using the same chain. It is sized from the chain itself, for
+# GROWTH_FACTOR times the products registered so far (at least
+# BARCODE_FILTER_MIN_CAPACITY, default 100k) at BARCODE_FILTER_FP_RATE
+# (default 1%):
+#   m = -n ln p / (ln 2)^2 bits  (~1.2 bytes per product at 1%),  k = m/n ln 2
+# The bit positions come from the barcode's SHA-256 digest itself (double
+# hashing, h1 + i*h2), so adding or testing a barcode hashes nothing.
+#
+# sync() adds the blocks the filter doesn't cover yet: it sets the bits,
+# flushes them, and only then records the blocks in the header, so after a
+# crash the filter may re-add a block but never claims one whose bits were
+# lost. When the filter would go over capacity, or the chain was rewritten,
+# a new filter is built from the whole chain in a temporary file and renamed
+# into place. A mapped file is never truncated or resized, so processes still
+# reading the old one are not cut off; each process maps the new file on its
+# next sync().
+
+MAGIC = b"ABLOOM01"
+FORMAT_VERSION = 2
+HEADER = struct.Struct("<8sIIQQdQQ64s")
+HEADER_SIZE = 128
+FILTER_SUFFIX = ".bloom"
+LOCK_SUFFIX = ".bloom.lock"
+GROWTH_FACTOR = 2
+
+FILTER_MIN_CAPACITY = int(os.environ.get("BARCODE_FILTER_MIN_CAPACITY", 100_000))
+FILTER_FP_RATE = float(os.environ.get("BARCODE_FILTER_FP_RATE", 0.01))
+
+
+def filter_path_for(json_path):
+    return f"{os.path.splitext(json_path)[0]}{FILTER_SUFFIX}"
+
+
+# (bits, hash functions) for `capacity` items at false-positive rate `fp_rate`
+def filter_size(capacity, fp_rate):
+    if not 0 < fp_rate < 1:
+        raise ValueError("The false-positive rate must be between 0 and 1")
+    capacity = max(1, capacity)
+    bits = math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)
+    bits = -(-bits // 8) * 8
+    hashes = max(1, round(bits / capacity * math.log(2)))
+    return bits, hashes
+
+
+def _digest(barcode_hash):
+    digest = chain_model.pack_hash(barcode_hash)
+    if isinstance(digest, bytes):
+        return digest
+    return hashlib.sha256(str(barcode_hash).encode()).digest()
+
+
+def _positions(barcode_hash, bits, hashes):
+    digest = _digest(barcode_hash)
+    h1 = int.from_bytes(digest[:8], "little")
+    h2 = int.from_bytes(digest[8:16], "little") | 1
+    return [(h1 + i * h2) % bits for i in range(hashes)]
+
+
+class BarcodeFilter:
+    def __init__(self, path, fp_rate=FILTER_FP_RATE, min_capacity=FILTER_MIN_CAPACITY):
+        self.path = path
+        self.lock_path = os.path.splitext(path)[0] + LOCK_SUFFIX
+        self.fp_rate = fp_rate
+        self.min_capacity = min_capacity
+        filter_size(min_capacity, fp_rate)  # validates the settings
+        self.lock = threading.RLock()
+        # (map, bits, hashes, capacity), swapped in one assignment so lookups
+        # never mix the parameters of one file with the bits of another
+        self.state = None
+        self.identity = None
+        with self._locked():
+            if not self._map_file():
+                self._rebuild([])
+
+    # Map the filter file; False when it is missing or unusable
+    def _map_file(self):
+        try:
+            fd = os.open(self.path, os.O_RDWR)
+        except FileNotFoundError:
+            return False
+        try:
+            stat = os.fstat(fd)
+            header = os.read(fd, HEADER.size)
+            if len(header) < HEADER.size:
+                return False
+            magic, version, hashes, bits, capacity, fp_rate, _, _, _ = HEADER.unpack(header)
+            size = HEADER_SIZE + bits // 8
+            if (magic, version, fp_rate) != (MAGIC, FORMAT_VERSION, self.fp_rate) or stat.st_size != size:
+                return False
+            self.state = (mmap.mmap(fd, size), bits, hashes, capacity)
+            self.identity = (stat.st_dev, stat.st_ino)
+            return True
+        finally:
+            os.close(fd)
+
+    # Another process renamed a new filter into place: map it instead
+    def _reopen_if_replaced(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            stat = None
+        if stat is None or (stat.st_dev, stat.st_ino) != self.identity:
+            if not self._map_file():
+                self._rebuild([])
+
+    # Build a filter for `blockchain` in a temporary file and rename it into place
+    def _rebuild(self, blockchain, chunk_size=1000):
+        products = sum(len(block["product_details"]) for block in blockchain)
+        capacity = max(self.min_capacity, products * GROWTH_FACTOR)
+        bits, hashes = filter_size(capacity, self.fp_rate)
+        size = HEADER_SIZE + bits // 8
+        tmp_path = self.path + ".tmp"
+        fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)  # the bits start out as zeros
+            data = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        state = (data, bits, hashes, capacity)
+        data[:HEADER.size] = self._header(state, 0, 0, "")
+        for start in range(0, len(blockchain), chunk_size):
+            self._add_blocks(state, blockchain[start:start + chunk_size])
+        data.flush()
+        os.replace(tmp_path, self.path)
+        stat = os.stat(self.path)
+        self.state = state
+        self.identity = (stat.st_dev, stat.st_ino)
+
+    def _header(self, state, count, covered, tip_hash):
+        _, bits, hashes, capacity = state
+        return HEADER.pack(MAGIC, FORMAT_VERSION, hashes, bits, capacity, self.fp_rate,
+                           count, covered, tip_hash.encode()[:64])
+
+    def _read_header(self, state):
+        header = HEADER.unpack_from(state[0], 0)
+        return header[6], header[7], header[8].rstrip(b"\0").decode()
+
+    @property
+    def bits(self):
+        return self.state[1]
+
+    @property
+    def hashes(self):
+        return self.state[2]
+
+    @property
+    def capacity(self):
+        return self.state[3]
+
+    # Barcodes added so far, blocks covered
+    @property
+    def count(self):
+        return self._read_header(self.state)[0]
+
+    @property
+    def covered(self):
+        return self._read_header(self.state)[1]
+
+    # Serializes writers in this process and, where fcntl exists, across processes
+    @contextmanager
+    def _locked(self):
+        with self.lock:
+            lock_file = open(self.lock_path, 'a')
+            try:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                yield
+            finally:
+                lock_file.close()
+
+    def __contains__(self, barcode_hash):
+        data, bits, hashes, _ = self.state
+        for position in _positions(barcode_hash, bits, hashes):
+            if not data[HEADER_SIZE + (position >> 3)] & (1 << (position & 7)):
+                return False
+        return True
+
+    def _add_blocks(self, state, blocks):
+        data, bits, hashes, _ = state
+        count, covered, tip_hash = self._read_header(state)
+        for block in blocks:
+            for product in block["product_details"]:
+                barcode_hash = product.get("barcode_hash")
+                if barcode_hash is not None:
+                    for position in _positions(barcode_hash, bits, hashes):
+                        data[HEADER_SIZE + (position >> 3)] |= 1 << (position & 7)
+                    count += 1
+            covered = max(covered, block["index"] + 1)
+            tip_hash = block["hash"]
+        data.flush()
+        data[:HEADER.size] = self._header(state, count, covered, tip_hash)
+        data.flush()
+
+    # Add the blocks of `blockchain` the filter doesn't cover yet, growing
+    # or rebuilding it when needed; returns the number of blocks added
+    def sync(self, blockchain, chunk_size=1000):
+        with self._locked():
+            self._reopen_if_replaced()
+            state = self.state
+            count, covered, tip_hash = self._read_header(state)
+            if covered > len(blockchain) or (covered and blockchain[covered - 1]["hash"] != tip_hash):
+                # The chain was rewritten: start over from the whole chain
+                self._rebuild(blockchain, chunk_size)
+                return len(blockchain)
+            blocks = blockchain[covered:]
+            if count + sum(len(block["product_details"]) for block in blocks) > state[3]:
+                # Would go over capacity: a bigger filter for the whole chain
+                self._rebuild(blockchain, chunk_size)
+                return len(blocks)
+            for start in range(0, len(blocks), chunk_size):
+                self._add_blocks(state, blocks[start:start + chunk_size])
+            return len(blocks)
+
+    # Expected false-positive rate at the current fill
+    def estimated_fp_rate(self):
+        return (1 - math.exp(-self.hashes * self.count / self.bits)) ** self.hashes
+
+
+_filters = {}
+_registry_lock = threading.Lock()
+
+
+# One filter per file for the whole process
+def get_filter(path, fp_rate=FILTER_FP_RATE, min_capacity=FILTER_MIN_CAPACITY):
+    with _registry_lock:
+        key = os.path.abspath(path)
+        barcode_filter = _filters.get(key)
+        if barcode_filter is None or (barcode_filter.fp_rate, barcode_filter.min_capacity) != (fp_rate, min_capacity):
+            barcode_filter = _filters[key] = BarcodeFilter(path, fp_rate, min_capacity)
+        return barcode_filter
@@ -0,0 +1,184 @@
+import atexit
+import logging
+import threading
+import time
+from contextlib import nullcontext
+
+import block_hashing
+
+# Batched block sealing
+#
+# Products are queued and a block is sealed once it holds `block_size`
+# products or the oldest queued product has waited `max_wait` seconds.
+# Sealing a block costs one hash and one durable append to the block log,
+# no matter how many products it holds. submit_many() seals every full
+# block of a large batch with a single write. Any chain store from
+# chain_storage (block log or SQLite) can be used.
+#
+# Streamlit reruns the app script on every interaction, so batchers live in
+# a process-wide registry (get_batcher) and the script re-attaches its
+# freshly loaded chain with attach() on each run.
+#
+# A barcode is queued at most once. When a guard (chain_cache.SharedChain)
+# is attached, queuing and sealing run inside its writing() lock and skip
+# barcodes that are already on the chain, so duplicates can't slip in
+# between another writer's check and append. The guard's lock is always
+# taken before the batcher's own, the same order add_block uses.
+#
+# Queued products are not on the chain until their block is sealed. Every
+# batcher in the registry is flushed when the interpreter exits normally;
+# a killed process loses its queue, so callers report queued products as
+# queued, not as registered.
+
+logger = logging.getLogger(__name__)
+
+
+class BlockBatcher:
+    def __init__(self, chain_store, block_size=31, max_wait=5.0):
+        self.chain_store = chain_store
+        self.block_size = block_size
+        self.max_wait = max_wait
+        self.blockchain = None
+        self.on_seal = None
+        self.guard = None
+        self.pending = []
+        self.pending_hashes = set()
+        self.lock = threading.RLock()
+        self.timer = None
+
+    # Seal onto this chain list and call on_seal(block) for every new block
+    def attach(self, blockchain, on_seal=None, guard=None):
+        with self.lock:
+            self.blockchain = blockchain
+            self.on_seal = on_seal
+            self.guard = guard
+
+    # The guard's write lock, with the chain it yields adopted for sealing
+    def _writing(self):
+        if self.guard is None:
+            return nullcontext(self.blockchain)
+        return self.guard.writing()
+
+    def _is_registered(self, barcode_hash):
+        return self.guard is not None and self.guard.contains_barcode(barcode_hash)
+
+    def is_pending(self, barcode_hash):
+        return barcode_hash in self.pending_hashes
+
+    def pending_count(self):
+        return len(self.pending)
+
+    def _new_block(self, product_details, previous_block):
+        block = {
+            "index": previous_block["index"] + 1,
+            "timestamp": time.time(),
+            "product_details": product_details,
+            "previous_hash": previous_block["hash"],
+            "hash_version": block_hashing.HASH_VERSION,
+            "hash": "temporary_placeholder"
+        }
+        block["hash"] = block_hashing.compute_block_hash(block)
+        return block
+
+    # Turn queued products into blocks (only full ones unless `partial`) and
+    # write all of them to the log in one append
+    def _seal(self, partial=False):
+        if self.guard is not None and self.pending:
+            # Another process may have registered a queued barcode meanwhile
+            queued = []
+            for product in self.pending:
+                if self._is_registered(product["barcode_hash"]):
+                    self.pending_hashes.discard(product["barcode_hash"])
+                    logger.info("Dropped queued product with Barcode Hash: %s (already registered)", product["barcode_hash"])
+                else:
+                    queued.append(product)
+            self.pending = queued
+        sealed = []
+        while len(self.pending) >= self.block_size or (partial and self.pending):
+            product_details = self.pending[:self.block_size]
+            del self.pending[:self.block_size]
+            sealed.append(self._new_block(product_details, sealed[-1] if sealed else self.blockchain[-1]))
+        if not sealed:
+            return sealed
+
+        # Written to the log before the in-memory chain, so a failed write
+        # leaves the chain as it was and the products queued
+        try:
+            self.chain_store.append_many(sealed)
+        except BaseException:
+            self.pending[:0] = [product for block in sealed for product in block["product_details"]]
+            raise
+        self.blockchain.extend(sealed)
+        for block in sealed:
+            for product in block["product_details"]:
+                self.pending_hashes.discard(product["barcode_hash"])
+            if self.on_seal is not None:
+                self.on_seal(block)
+
+        if not self.pending and self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        return sealed
+
+    def _start_timer(self):
+        if self.timer is None and self.pending and self.max_wait is not None:
+            self.timer = threading.Timer(self.max_wait, self._deadline)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _deadline(self):
+        with self._writing() as blockchain, self.lock:
+            self.timer = None
+            self._adopt(blockchain)
+            self._seal(partial=True)
+
+    def _adopt(self, blockchain):
+        if blockchain is not None:
+            self.blockchain = blockchain
+
+    # Queue one product; returns the blocks sealed by this call (if any)
+    def submit(self, product_details, barcode_hash):
+        return self.submit_many([(product_details, barcode_hash)])
+
+    # Queue many (product_details, barcode_hash) pairs at once. Barcodes that
+    # are queued or registered already are skipped.
+    def submit_many(self, products):
+        with self._writing() as blockchain, self.lock:
+            self._adopt(blockchain)
+            for product_details, barcode_hash in products:
+                if barcode_hash in self.pending_hashes or self._is_registered(barcode_hash):
+                    continue
+                self.pending.append({"product": product_details, "barcode_hash": barcode_hash})
+                self.pending_hashes.add(barcode_hash)
+            sealed = self._seal()
+            self._start_timer()
+            return sealed
+
+    # Seal whatever is queued right away, even a partially filled block
+    def flush(self):
+        with self._writing() as blockchain, self.lock:
+            self._adopt(blockchain)
+            return self._seal(partial=True)
+
+
+_batchers = {}
+_registry_lock = threading.Lock()
+
+
+# One batcher per block log for the whole process
+def get_batcher(chain_store, block_size=31, max_wait=5.0):
+    with _registry_lock:
+        batcher = _batchers.get(chain_store.path)
+        if batcher is None:
+            batcher = _batchers[chain_store.path] = BlockBatcher(chain_store, block_size, max_wait)
+        return batcher
+
+
+# Seal every queued product before the process exits
+@atexit.register
+def flush_all():
+    with _registry_lock:
+        batchers = list(_batchers.values())
+    for batcher in batchers:
+        if batcher.pending and batcher.blockchain is not None:
+            batcher.flush()
@@ -0,0 +1,96 @@
+import hashlib
+import struct
+
+# Canonical block hashing
+#
+# Version 2 blocks are hashed over a fixed binary header:
+#   version | index | timestamp | previous_hash | merkle root of product_details
+# Each product is a Merkle leaf hashed over length-prefixed fields, so
+# product names can't run into each other the way they could in the legacy
+# string, and the root is built in one pass with MerkleAccumulator.
+#
+# Blocks without a "hash_version" field were hashed with the original
+# f-string/repr scheme and are still verified that way (compatibility mode).
+
+LEGACY_HASH_VERSION = 1
+HASH_VERSION = 2
+
+HEADER = struct.Struct(">BQdH")
+FIELD_LENGTH = struct.Struct(">I")
+LEAF_PREFIX = b"\x00"
+NODE_PREFIX = b"\x01"
+EMPTY_ROOT = hashlib.sha256(b"").digest()
+
+
+def legacy_hash_block(block):
+    block_string = f"{block['index']}{block['timestamp']}{block['product_details']}{block['previous_hash']}"
+    return hashlib.sha256(block_string.encode()).hexdigest()
+
+
+def _field(value):
+    data = (value or "").encode()
+    return FIELD_LENGTH.pack(len(data)) + data
+
+
+def product_leaf(product):
+    details = product["product"]
+    return hashlib.sha256(
+        LEAF_PREFIX
+        + _field(details.get("product_name"))
+        + _field(details.get("manufacturer_name"))
+        + _field(product.get("barcode_hash"))
+    ).digest()
+
+
+def _node(left, right):
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+
+# Incremental Merkle tree: keeps one peak per perfect subtree (like a binary
+# counter), so an append merges at most log2(n) nodes and the root is the
+# peaks folded right to left.
+class MerkleAccumulator:
+    def __init__(self):
+        self.peaks = []  # (height, digest), heights strictly decreasing
+        self.count = 0
+
+    def append(self, leaf):
+        height, node = 0, leaf
+        while self.peaks and self.peaks[-1][0] == height:
+            node = _node(self.peaks.pop()[1], node)
+            height += 1
+        self.peaks.append((height, node))
+        self.count += 1
+
+    def root(self):
+        if not self.peaks:
+            return EMPTY_ROOT
+        node = self.peaks[-1][1]
+        for _, peak in reversed(self.peaks[:-1]):
+            node = _node(peak, node)
+        return node
+
+
+def merkle_root(product_details):
+    accumulator = MerkleAccumulator()
+    for product in product_details:
+        accumulator.append(product_leaf(product))
+    return accumulator.root()
+
+
+def encode_header(block, root):
+    previous_hash = block["previous_hash"].encode()
+    return HEADER.pack(
+        HASH_VERSION, block["index"], float(block["timestamp"]), len(previous_hash)
+    ) + previous_hash + root
+
+
+# Safe for any block, from any session or process
+def compute_block_hash(block):
+    if block.get("hash_version", LEGACY_HASH_VERSION) == LEGACY_HASH_VERSION:
+        return legacy_hash_block(block)
+    return hashlib.sha256(encode_header(block, merkle_root(block["product_details"]))).hexdigest()
+
+
+def verify_block_hash(block):
+    return compute_block_hash(block) == block["hash"]
@@ -0,0 +1,263 @@
+import json
+import os
+import sys
+import threading
+import zlib
+
+# Append-only block log
+#
+# Every block is stored as one line: "<crc32 hex> <compact json>\n".
+# Adding a block is a single write + fsync instead of re-dumping the whole
+# chain. When a block is updated in place (application.py fills the last
+# block up to its capacity) the new version is simply appended again and
+# the latest record for an index wins when the log is read back.
+#
+# A small footer file next to the log remembers where every block starts
+# and how many bytes of the log it covers, so reopening only has to scan
+# the records written after the footer was last saved.
+#
+# Only the last record of the log can be torn, by a crash during a write
+# or because another process is still writing it; load() ignores it. A bad
+# record anywhere else means the file was damaged, so loading stops with
+# CorruptLogError and leaves the log untouched instead of cutting off the
+# valid blocks after it.
+#
+# load() never writes: any process may read the log at any time. The file
+# and the footer are only modified by append_many() and compact(), which
+# callers run under the chain's write lock (chain_cache.SharedChain.writing).
+# append_many() first catches up with records other processes appended and
+# only then cuts off a torn tail, so it can't cut into a record that is
+# still being written.
+
+LOG_SUFFIX = ".log"
+FOOTER_SUFFIX = ".footer"
+
+# Rewrite the footer after this many appends (it is only an accelerator,
+# the log itself is always the source of truth)
+FOOTER_EVERY = 64
+
+
+class CorruptLogError(RuntimeError):
+    pass
+
+
+def log_path_for(json_path):
+    return os.path.splitext(json_path)[0] + LOG_SUFFIX
+
+
+def encode_record(block):
+    payload = json.dumps(block, separators=(",", ":")).encode()
+    return b"%08x " % zlib.crc32(payload) + payload + b"\n"
+
+
+def decode_record(line):
+    checksum, _, payload = line.rstrip(b"\n").partition(b" ")
+    try:
+        valid = int(checksum, 16) == zlib.crc32(payload)
+    except ValueError:
+        valid = False
+    if not valid:
+        raise ValueError("Block record failed its checksum")
+    return json.loads(payload)
+
+
+class BlockLog:
+    def __init__(self, path):
+        self.path = path
+        self.footer_path = path + FOOTER_SUFFIX
+        self.offsets = []  # offsets[i] = byte offset of the latest record of block i
+        self.size = 0  # bytes of the log known to hold complete, valid records
+        self.appends_since_footer = 0
+        self.footer_stale = False  # the footer is behind `offsets`, rewrite it on the next append
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    # Changes whenever the log file is written
+    def signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def _load_footer(self):
+        if not os.path.exists(self.footer_path):
+            return [], 0
+        try:
+            with open(self.footer_path, 'r') as f:
+                footer = json.load(f)
+            return footer["offsets"], footer["size"]
+        except (OSError, ValueError, KeyError):
+            return [], 0
+
+    def save_footer(self):
+        # Unique per process and thread, so concurrent writers never share a temporary file
+        tmp_path = f"{self.footer_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"size": self.size, "offsets": self.offsets}, f)
+        os.replace(tmp_path, self.footer_path)
+        self.appends_since_footer = 0
+        self.footer_stale = False
+
+    # Scan records from `start` to the end of the log, yielding (offset, block).
+    # A torn or bad last record (crash during a write) ends the scan; a bad
+    # record with more data after it raises CorruptLogError.
+    def _scan(self, f, start):
+        f.seek(start)
+        offset = start
+        while True:
+            line = f.readline()
+            if not line.endswith(b"\n"):
+                break
+            try:
+                block = decode_record(line)
+            except ValueError:
+                if f.read(1):
+                    raise CorruptLogError(f"{self.path}: corrupted block record at byte {offset}; "
+                                          f"the log was left as is, restore it from a backup")
+                break
+            yield offset, block
+            offset += len(line)
+        self.size = offset
+
+    def _track(self, offset, block):
+        index = block["index"]
+        if index < len(self.offsets):
+            self.offsets[index] = offset
+        else:
+            self.offsets.append(offset)
+
+    # Load the whole chain, resuming from the footer when it is still valid.
+    # Read-only: a torn last record is skipped, not cut off.
+    def load(self):
+        if not self.exists():
+            self.offsets, self.size = [], 0
+            return []
+
+        offsets, size = self._load_footer()
+        if size > os.path.getsize(self.path):
+            offsets, size = [], 0
+        self.offsets = list(offsets)
+
+        blockchain = []
+        with open(self.path, 'rb') as f:
+            # Blocks covered by the footer are read directly at their offsets
+            try:
+                for offset in self.offsets:
+                    f.seek(offset)
+                    blockchain.append(decode_record(f.readline()))
+            except ValueError:
+                # Stale footer, fall back to a full scan
+                blockchain, self.offsets, size = [], [], 0
+            for offset, block in self._scan(f, size):
+                self._track(offset, block)
+                if block["index"] < len(blockchain):
+                    blockchain[block["index"]] = block
+                else:
+                    blockchain.append(block)
+
+        self.footer_stale = self.offsets != offsets
+        return blockchain
+
+    # Read blocks [start, stop) straight from their offsets
+    def read_range(self, start, stop=None):
+        stop = len(self.offsets) if stop is None else min(stop, len(self.offsets))
+        blocks = []
+        if start >= stop:
+            return blocks
+        with open(self.path, 'rb') as f:
+            for offset in self.offsets[start:stop]:
+                f.seek(offset)
+                blocks.append(decode_record(f.readline()))
+        return blocks
+
+    def read_block(self, index):
+        blocks = self.read_range(index, index + 1)
+        return blocks[0] if blocks else None
+
+    # Append a new block, or a newer version of an existing one
+    def append(self, block):
+        self.append_many([block])
+
+    def append_many(self, blocks):
+        if not blocks:
+            return
+        records = [encode_record(block) for block in blocks]
+        with open(self.path, 'a+b') as f:
+            if os.fstat(f.fileno()).st_size != self.size:
+                # Track records appended since this log was loaded, then
+                # drop a torn tail so the new records start on a clean line
+                for offset, block in self._scan(f, self.size):
+                    self._track(offset, block)
+                if os.fstat(f.fileno()).st_size > self.size:
+                    f.truncate(self.size)
+            f.write(b"".join(records))
+            f.flush()
+            os.fsync(f.fileno())
+        offset = self.size
+        for block, record in zip(blocks, records):
+            self._track(offset, block)
+            offset += len(record)
+        self.size = offset
+
+        self.appends_since_footer += len(blocks)
+        if self.footer_stale or self.appends_since_footer >= FOOTER_EVERY:
+            self.save_footer()
+
+    # Rewrite the log keeping only the latest version of every block
+    def compact(self, blockchain):
+        tmp_path = self.path + ".tmp"
+        offsets = []
+        offset = 0
+        with open(tmp_path, 'wb') as f:
+            for block in blockchain:
+                record = encode_record(block)
+                f.write(record)
+                offsets.append(offset)
+                offset += len(record)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.offsets, self.size = offsets, offset
+        self.save_footer()
+
+
+# One-shot migration of a legacy blockchain.json / blockchain_data.json file
+def migrate_json_chain(json_path, log_path=None):
+    log_path = log_path or log_path_for(json_path)
+    with open(json_path, 'r') as f:
+        blockchain = json.load(f)
+    block_log = BlockLog(log_path)
+    block_log.compact(blockchain)
+    return block_log
+
+
+# Read a chain without side effects: the log when present, else the legacy JSON
+def read_chain(json_path):
+    block_log = BlockLog(log_path_for(json_path))
+    if block_log.exists():
+        return block_log.load()
+    if os.path.exists(json_path):
+        with open(json_path, 'r') as f:
+            return json.load(f)
+    return []
+
+
+# Open the log for a chain, migrating the legacy JSON file the first time
+def open_chain(json_path):
+    block_log = BlockLog(log_path_for(json_path))
+    if not block_log.exists() and os.path.exists(json_path):
+        migrate_json_chain(json_path, block_log.path)
+    return block_log, block_log.load()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python block_store.py <blockchain.json> [<output.log>]")
+        sys.exit(1)
+    migrated = migrate_json_chain(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
+    print(f"Migrated {len(migrated)} blocks to {migrated.path}")
@@ -0,0 +1,159 @@
+import argparse
+import csv
+import io
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import block_batcher
+import chain_cache
+import chain_columns
+import file_hashing
+
+# Bulk product registration
+#
+# A manifest (CSV or Parquet) lists one product per row with the columns
+# product_name, manufacturer_name and barcode_file, where barcode_file names
+# a member of the accompanying zip of barcode files. Rows are streamed in
+# chunks: the barcode files of a chunk are hashed in a thread pool (zlib and
+# hashlib release the GIL), duplicates are dropped against the barcode index
+# and the rest is handed to the block batcher in one call.
+
+CHUNK_SIZE = 1000
+MANIFEST_COLUMNS = ["product_name", "manufacturer_name", "barcode_file"]
+
+
+def manifest_format(manifest):
+    name = manifest if isinstance(manifest, str) else getattr(manifest, "name", "")
+    return "parquet" if os.path.splitext(name)[1].lower() in (".parquet", ".pq") else "csv"
+
+
+def _read_csv(manifest):
+    if isinstance(manifest, str):
+        with open(manifest, 'r', newline='', encoding='utf-8-sig') as f:
+            yield from csv.DictReader(f)
+    else:
+        yield from csv.DictReader(io.TextIOWrapper(manifest, encoding='utf-8-sig', newline=''))
+
+
+def _read_parquet(manifest, batch_size):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Reading Parquet manifests requires pyarrow (pip install pyarrow)")
+    parquet_file = pq.ParquetFile(manifest)
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=MANIFEST_COLUMNS):
+        yield from batch.to_pylist()
+
+
+# Stream manifest rows as dicts without loading the whole file
+def read_manifest(manifest, fmt=None, batch_size=CHUNK_SIZE):
+    fmt = fmt or manifest_format(manifest)
+    if fmt == "parquet":
+        return _read_parquet(manifest, batch_size)
+    return _read_csv(manifest)
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _hash_member(barcodes, member_name):
+    try:
+        with barcodes.open(member_name) as member:
+            return file_hashing.hash_upload(member)
+    except KeyError:
+        return None
+
+
+# Import every manifest row. `register(products)` receives lists of
+# (product_details, barcode_hash) pairs and returns the pairs it registered
+# (another writer may have registered some of them meanwhile; those count as
+# duplicates); `is_registered(barcode_hash)` tells whether a barcode is
+# already on the chain. `progress(stats)` is called after every chunk.
+# Returns the final stats dict.
+def import_products(manifest, barcodes_zip, register, is_registered=None, fmt=None,
+                    workers=None, chunk_size=CHUNK_SIZE, progress=None):
+    stats = {"rows": 0, "imported": 0, "duplicates": 0, "missing": 0, "seconds": 0.0, "rows_per_sec": 0.0}
+    started = time.perf_counter()
+    seen = set()
+
+    with zipfile.ZipFile(barcodes_zip) as barcodes, ThreadPoolExecutor(max_workers=workers) as executor:
+        for chunk in _chunks(read_manifest(manifest, fmt, chunk_size), chunk_size):
+            hashes = executor.map(lambda row: _hash_member(barcodes, row["barcode_file"]), chunk)
+
+            products = []
+            for row, barcode_hash in zip(chunk, hashes):
+                if barcode_hash is None:
+                    stats["missing"] += 1
+                elif barcode_hash in seen or (is_registered is not None and is_registered(barcode_hash)):
+                    stats["duplicates"] += 1
+                else:
+                    seen.add(barcode_hash)
+                    products.append(({
+                        "product_name": row["product_name"],
+                        "manufacturer_name": row["manufacturer_name"]
+                    }, barcode_hash))
+            registered = register(products) if products else []
+            stats["duplicates"] += len(products) - len(registered)
+
+            stats["rows"] += len(chunk)
+            stats["imported"] += len(registered)
+            stats["seconds"] = time.perf_counter() - started
+            stats["rows_per_sec"] = stats["rows"] / stats["seconds"] if stats["seconds"] > 0 else 0.0
+            if progress is not None:
+                progress(stats)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Register a catalogue of products from a manifest and a zip of barcode files.")
+    parser.add_argument("manifest", help="CSV or Parquet file with product_name, manufacturer_name, barcode_file")
+    parser.add_argument("barcodes", help="zip archive holding the barcode files named in the manifest")
+    parser.add_argument("--chain", default="blockchain_data.json", help="blockchain JSON file (its configured store is used)")
+    parser.add_argument("--block-size", type=int, default=31, help="products per sealed block")
+    parser.add_argument("--workers", type=int, default=None, help="hashing threads")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="manifest rows per batch")
+    args = parser.parse_args(argv)
+
+    # The shared chain's write lock and barcode check keep the import from
+    # registering barcodes another writer adds while it runs
+    shared_chain = chain_cache.get_shared_chain(args.chain)
+    shared_chain.refresh()
+
+    batcher = block_batcher.BlockBatcher(shared_chain.store, args.block_size, max_wait=None)
+    batcher.attach(shared_chain.blockchain, shared_chain.committed, shared_chain)
+
+    # Queue the products not registered or queued yet, under the write lock
+    def register(products):
+        with shared_chain.writing():
+            accepted = [(product_details, barcode_hash) for product_details, barcode_hash in products
+                        if not batcher.is_pending(barcode_hash) and not shared_chain.contains_barcode(barcode_hash)]
+            batcher.submit_many(accepted)
+        return accepted
+
+    def report(stats):
+        print(f"\r{stats['rows']} rows, {stats['imported']} imported, {stats['duplicates']} duplicates, "
+              f"{stats['missing']} missing files ({stats['rows_per_sec']:.0f} rows/sec)", end="", flush=True)
+
+    stats = import_products(args.manifest, args.barcodes, register, shared_chain.contains_barcode,
+                            workers=args.workers, chunk_size=args.chunk_size, progress=report)
+    batcher.flush()
+    if chain_columns.available():
+        # The process exits before a scheduled snapshot sync would run
+        chain_columns.get_snapshot(chain_columns.columns_dir_for(args.chain)).sync(shared_chain.blockchain)
+    print(f"\nDone in {stats['seconds']:.2f}s, chain now has {len(shared_chain.blockchain)} blocks.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
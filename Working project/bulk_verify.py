@@ -0,0 +1,160 @@
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import chain_index
+import chain_mmap
+import chain_storage
+import file_hashing
+
+# Bulk barcode verification
+#
+# Retailers verify whole shipments at once: either many barcode files or a
+# list of precomputed SHA-256 hashes. Files are hashed concurrently, hashes
+# are resolved against an index a chunk at a time, and results are streamed
+# back per item as CSV or JSON lines followed by the overall timing.
+
+CHUNK_SIZE = 500
+RESULT_FIELDS = ["item", "barcode_hash", "status", "product_name", "manufacturer_name"]
+HEX_DIGITS = set("0123456789abcdef")
+
+
+def is_sha256_hex(value):
+    return len(value) == 64 and set(value) <= HEX_DIGITS
+
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _hash_item(item):
+    if isinstance(item[1], str):
+        return file_hashing.hash_path(item[1])
+    return file_hashing.hash_file(item[1])
+
+
+# Hash (name, file object or path) pairs concurrently, yielding
+# (name, barcode_hash) in input order
+def hash_files(files, workers=None, chunk_size=CHUNK_SIZE):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for chunk in _chunks(files, chunk_size):
+            hashes = executor.map(_hash_item, chunk)
+            for (name, _), barcode_hash in zip(chunk, hashes):
+                yield name, barcode_hash
+
+
+# Precomputed hashes are their own item names
+def hash_list(hashes):
+    for barcode_hash in hashes:
+        barcode_hash = barcode_hash.strip().lower()
+        if barcode_hash:
+            yield barcode_hash, barcode_hash
+
+
+# Resolve (name, barcode_hash) pairs. `resolve(hashes)` returns a dict
+# barcode_hash -> product fields (e.g. product_name, manufacturer_name) for
+# the hashes that are registered; it is called once per chunk.
+def verify_items(items, resolve, chunk_size=CHUNK_SIZE):
+    for chunk in _chunks(items, chunk_size):
+        found = resolve([barcode_hash for _, barcode_hash in chunk if is_sha256_hex(barcode_hash)])
+        for name, barcode_hash in chunk:
+            product = found.get(barcode_hash)
+            if product is not None:
+                status = "verified"
+            elif is_sha256_hex(barcode_hash):
+                status = "counterfeit"
+            else:
+                status = "invalid"
+            result = {"item": name, "barcode_hash": barcode_hash, "status": status}
+            if product:
+                result.update(product)
+            yield result
+
+
+# Resolver over an in-memory chain and its BarcodeIndex
+def chain_resolver(blockchain, barcode_index):
+    def resolve(hashes):
+        found = {}
+        for barcode_hash in hashes:
+            position = barcode_index.lookup(barcode_hash)
+            if position is not None:
+                block_index, product_index = position
+                found[barcode_hash] = blockchain[block_index]["product_details"][product_index]["product"]
+        return found
+    return resolve
+
+
+# Yield the results as text (CSV rows or JSON lines) with a final summary
+def stream_results(results, fmt="csv", fields=RESULT_FIELDS):
+    started = time.perf_counter()
+    counts = {"verified": 0, "counterfeit": 0, "invalid": 0}
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, restval="", extrasaction="ignore")
+    if fmt == "csv":
+        writer.writeheader()
+        yield buffer.getvalue()
+
+    for result in results:
+        counts[result["status"]] += 1
+        if fmt == "csv":
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow(result)
+            yield buffer.getvalue()
+        else:
+            yield json.dumps(result) + "\n"
+
+    seconds = time.perf_counter() - started
+    total = sum(counts.values())
+    summary = dict(counts, items=total, seconds=round(seconds, 6),
+                   items_per_sec=round(total / seconds, 1) if seconds > 0 else 0.0)
+    if fmt == "csv":
+        yield "# " + ", ".join(f"{key}={value}" for key, value in summary.items()) + "\n"
+    else:
+        yield json.dumps({"summary": summary}) + "\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verify many barcode files or hashes against the blockchain.")
+    parser.add_argument("files", nargs="*", help="barcode files to hash and verify")
+    parser.add_argument("--hashes", help="file with one precomputed SHA-256 hash per line ('-' for stdin)")
+    parser.add_argument("--chain", default="blockchain_data.json", help="blockchain JSON file (its configured store is used when present)")
+    parser.add_argument("--format", choices=["csv", "json"], default="csv")
+    parser.add_argument("--workers", type=int, default=None, help="hashing threads")
+    parser.add_argument("--chain-file", help="resolve against this memory-mapped chain file (see chain_mmap.py) "
+                                             "instead of loading the chain")
+    args = parser.parse_args(argv)
+
+    if args.chain_file:
+        resolve = chain_mmap.ChainFile(args.chain_file).resolve
+    else:
+        blockchain = chain_storage.read_chain(args.chain)
+        barcode_index = chain_index.BarcodeIndex()
+        barcode_index.build(blockchain)
+        resolve = chain_resolver(blockchain, barcode_index)
+
+    if args.hashes:
+        hashes_file = sys.stdin if args.hashes == "-" else open(args.hashes, 'r')
+        items = hash_list(hashes_file)
+    else:
+        items = hash_files(((path, path) for path in args.files), args.workers)
+
+    for text in stream_results(verify_items(items, resolve), args.format):
+        sys.stdout.write(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
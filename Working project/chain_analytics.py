@@ -0,0 +1,118 @@
+import heapq
+import itertools
+import threading
+
+# Running analytics aggregates
+#
+# show_analytics used to rebuild the manufacturer list, a set of every
+# barcode and several pandas Series from the whole chain on each page view.
+# ChainAnalytics keeps those numbers up to date instead: add_block() touches
+# each product once (dict/set updates, O(1) per product, plus an O(log n)
+# push onto the top-manufacturer heap), and the analytics page only renders
+# what summary() returns.
+#
+# Top manufacturers come from a max-heap of (count, name) entries. A
+# manufacturer gets a new entry every time its count changes and stale
+# entries are skipped when the heap is read, so the heap is rebuilt from the
+# counts once it holds too many of them.
+#
+# Products are also counted per time bucket (by block timestamp) at a few
+# fixed widths at once. The products-over-time chart uses the finest width
+# that gives at most MAX_CHART_POINTS points, so drawing it costs the same
+# however many blocks there are.
+
+BUCKET_LEVELS = (60, 3600, 86400, 7 * 86400)  # minute, hour, day, week
+MAX_CHART_POINTS = 500
+TOP_K = 10
+
+_instances = itertools.count()
+
+
+class ChainAnalytics:
+    def __init__(self, bucket_levels=BUCKET_LEVELS):
+        self.instance = next(_instances)
+        self.lock = threading.Lock()
+        self.product_count = 0
+        self.block_count = 0
+        self.barcodes = set()
+        self.manufacturer_counts = {}
+        self.top_heap = []
+        self.time_buckets = {seconds: {} for seconds in bucket_levels}
+        self.version = 0
+
+    def add_block(self, block):
+        with self.lock:
+            self.block_count += 1
+            product_details = block["product_details"]
+            if product_details:
+                for seconds, buckets in self.time_buckets.items():
+                    bucket = int(block["timestamp"] // seconds) * seconds
+                    buckets[bucket] = buckets.get(bucket, 0) + len(product_details)
+            for product in product_details:
+                self.product_count += 1
+                self.barcodes.add(product.get("barcode_hash"))
+                manufacturer = product["product"]["manufacturer_name"]
+                count = self.manufacturer_counts.get(manufacturer, 0) + 1
+                self.manufacturer_counts[manufacturer] = count
+                heapq.heappush(self.top_heap, (-count, manufacturer))
+            if len(self.top_heap) > 4 * len(self.manufacturer_counts) + 64:
+                self._rebuild_heap()
+            self.version += 1
+
+    def build(self, blockchain):
+        for block in blockchain:
+            self.add_block(block)
+
+    def _rebuild_heap(self):
+        self.top_heap = [(-count, manufacturer) for manufacturer, count in self.manufacturer_counts.items()]
+        heapq.heapify(self.top_heap)
+
+    # Up to k (manufacturer, count) pairs, most products first, ties by name
+    # (the same manufacturer pandas' mode() picks)
+    def _top(self, k):
+        top = []
+        popped = []
+        while self.top_heap and len(top) < k:
+            entry = heapq.heappop(self.top_heap)
+            popped.append(entry)
+            count, manufacturer = -entry[0], entry[1]
+            if self.manufacturer_counts.get(manufacturer) == count:
+                top.append((manufacturer, count))
+        # Keep the current entries, drop the stale ones we walked past
+        for entry in popped:
+            if self.manufacturer_counts.get(entry[1]) == -entry[0]:
+                heapq.heappush(self.top_heap, entry)
+        return top
+
+    def top_manufacturers(self, k=TOP_K):
+        with self.lock:
+            return self._top(k)
+
+    # (bucket start, products) pairs, at most max_points of them
+    def _time_series(self, max_points):
+        for seconds, buckets in self.time_buckets.items():
+            if len(buckets) <= max_points:
+                return seconds, sorted(buckets.items())
+        # Longer than the widest level allows: merge neighbouring buckets
+        points = sorted(buckets.items())
+        group = -(-len(points) // max_points)
+        merged = [(points[i][0], sum(count for _, count in points[i:i + group])) for i in range(0, len(points), group)]
+        return seconds * group, merged
+
+    # A consistent copy of everything the analytics page shows. "version"
+    # changes whenever the aggregates do, so it can key cached charts.
+    def summary(self, top_k=TOP_K, max_points=MAX_CHART_POINTS):
+        with self.lock:
+            top = self._top(top_k)
+            bucket_seconds, time_buckets = self._time_series(max_points)
+            return {
+                "version": (self.instance, self.version),
+                "blocks": self.block_count,
+                "product_count": self.product_count,
+                "unique_barcodes": len(self.barcodes),
+                "most_frequent_manufacturer": top[0][0] if top else None,
+                "top_manufacturers": top,
+                "manufacturer_counts": dict(self.manufacturer_counts),
+                "bucket_seconds": bucket_seconds,
+                "time_buckets": time_buckets,
+            }
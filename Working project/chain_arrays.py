@@ -0,0 +1,409 @@
+import array
+import itertools
+import json
+import sys
+import threading
+import time
+
+import numpy as np
+
+import chain_model
+
+# Array-backed (columnar) in-memory chain
+#
+# ColumnarChain holds the chain without any per-product Python objects:
+#   digests            32 bytes per product in one bytearray (barcode hashes)
+#   manufacturer_codes / product_codes
+#                      int32 codes into per-column string dictionaries
+#   block_offsets      first product of every block (plus the end), int64
+#   timestamps         one float64 per block
+#   block_hashes / previous_hashes
+#                      32 bytes per block
+# Values that are not 64-char hex hashes ("genesis_block", "0", products
+# without a barcode) and blocks with keys outside the usual layout are kept
+# in small side dicts, so every block converts back to the exact dict it
+# came from.
+#
+# It is a drop-in for the chain list (len, indexing, slicing, iteration,
+# append, read_range) and blocks are rebuilt as dicts when read. On top of
+# that:
+#   - barcode lookups binary-search a sorted table of digest prefixes
+#     (np.searchsorted) and compare the full digest of the candidates; newly
+#     appended products sit in a small dict until MERGE_EVERY of them have
+#     piled up and are merged into the sorted table
+#   - summary() returns the same numbers as ChainAnalytics.summary(),
+#     computed with np.bincount / np.unique over the code and timestamp
+#     arrays
+#
+# chain_cache holds the shared chain this way when CHAIN_MODEL=columnar.
+
+DIGEST_SIZE = 32
+MERGE_EVERY = 4096
+TOP_K = 10
+MAX_CHART_POINTS = 500
+BUCKET_LEVELS = (60, 3600, 86400, 7 * 86400)  # minute, hour, day, week
+
+STANDARD_KEYS = ("index", "timestamp", "product_details", "previous_hash", "hash_version", "hash")
+NO_BARCODE = object()  # product without a "barcode_hash" key
+NO_DIGEST = bytes(DIGEST_SIZE)
+
+_instances = itertools.count()
+
+
+class StringDictionary:
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(sys.intern(value) if type(value) is str else value)
+        return code
+
+
+def _is_regular(block):
+    if any(key not in STANDARD_KEYS for key in block):
+        return False
+    for product in block["product_details"]:
+        if len(product["product"]) != 2 or any(key not in ("product", "barcode_hash") for key in product):
+            return False
+    return True
+
+
+class ColumnarChain:
+    def __init__(self, merge_every=MERGE_EVERY):
+        self.merge_every = merge_every
+        self.lock = threading.RLock()
+        self.instance = next(_instances)
+        self.version = 0
+
+        # per block
+        self.indexes = array.array('q')
+        self.timestamps = array.array('d')
+        self.block_offsets = array.array('q', [0])
+        self.hash_versions = array.array('b')      # -1: no "hash_version" key
+        self.block_hashes = bytearray()
+        self.previous_hashes = bytearray()
+        self.odd_hashes = {}          # block -> hash that isn't a hex digest
+        self.odd_previous = {}        # block -> previous_hash that isn't a hex digest
+        self.irregular = {}           # block -> original dict (unusual layout)
+
+        # per product
+        self.digests = bytearray()
+        self.manufacturer_codes = array.array('i')
+        self.product_codes = array.array('i')
+        self.manufacturers = StringDictionary()
+        self.products = StringDictionary()
+        self.odd_barcodes = {}        # product -> barcode that isn't a hex digest (or NO_BARCODE)
+        self.odd_barcode_positions = {}  # that barcode -> first product holding it
+
+        # barcode lookup: sorted digest prefixes plus the products not merged yet
+        self.sorted_keys = np.empty(0, dtype=np.uint64)
+        self.sorted_positions = np.empty(0, dtype=np.int64)
+        self.recent = {}              # digest -> first product, since the last merge
+
+        self._summary = None
+
+    # --- sequence interface ---------------------------------------------
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def _product(self, position):
+        product = {"product": {
+            "product_name": self.products.values[self.product_codes[position]],
+            "manufacturer_name": self.manufacturers.values[self.manufacturer_codes[position]],
+        }}
+        barcode = self.odd_barcodes[position] if position in self.odd_barcodes else \
+            self.digests[position * DIGEST_SIZE:(position + 1) * DIGEST_SIZE].hex()
+        if barcode is not NO_BARCODE:
+            product["barcode_hash"] = barcode
+        return product
+
+    def block(self, i):
+        if i in self.irregular:
+            return self.irregular[i]
+        start, stop = self.block_offsets[i], self.block_offsets[i + 1]
+        block = {
+            "index": self.indexes[i],
+            "timestamp": self.timestamps[i],
+            "product_details": [self._product(position) for position in range(start, stop)],
+            "previous_hash": self.odd_previous[i] if i in self.odd_previous else
+                self.previous_hashes[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE].hex(),
+        }
+        if self.hash_versions[i] >= 0:
+            block["hash_version"] = self.hash_versions[i]
+        block["hash"] = self.odd_hashes[i] if i in self.odd_hashes else \
+            self.block_hashes[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE].hex()
+        return block
+
+    def __getitem__(self, i):
+        with self.lock:
+            if isinstance(i, slice):
+                return [self.block(j) for j in range(*i.indices(len(self)))]
+            if i < 0:
+                i += len(self)
+            if not 0 <= i < len(self):
+                raise IndexError("block index out of range")
+            return self.block(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def read_range(self, start, stop):
+        return self[start:stop]
+
+    def append(self, block):
+        with self.lock:
+            self._append(block)
+            self.version += 1
+            if len(self.recent) >= self.merge_every:
+                self._merge()
+
+    def extend(self, blocks):
+        with self.lock:
+            for block in blocks:
+                self._append(block)
+            self.version += 1
+            if len(self.recent) >= self.merge_every:
+                self._merge()
+
+    def _append(self, block):
+        i = len(self)
+        if isinstance(block, chain_model.Block):
+            block = block.to_dict()
+
+        # Convert every field first, so a bad value (e.g. a string timestamp)
+        # raises before any array was appended to and they stay aligned
+        indexes = array.array('q', [block["index"]])
+        timestamps = array.array('d', [block["timestamp"]])
+        hash_versions = array.array('b', [block.get("hash_version", -1)])
+        hashes = [(chain_model.pack_hash(value), value) for value in (block["hash"], block["previous_hash"])]
+        product_codes = array.array('i')
+        manufacturer_codes = array.array('i')
+        digests = bytearray()
+        recent = {}
+        odd_barcodes = {}
+        odd_barcode_positions = {}
+        position = self.block_offsets[-1]
+        for product in block["product_details"]:
+            details = product["product"]
+            product_codes.append(self.products.code(details["product_name"]))
+            manufacturer_codes.append(self.manufacturers.code(details["manufacturer_name"]))
+            barcode = product.get("barcode_hash", NO_BARCODE)
+            digest = chain_model.pack_hash(barcode)
+            if isinstance(digest, bytes):
+                digests += digest
+                recent.setdefault(digest, position)
+            else:
+                digests += NO_DIGEST
+                odd_barcodes[position] = barcode
+                if barcode is not NO_BARCODE:
+                    odd_barcode_positions.setdefault(barcode, position)
+            position += 1
+        regular = _is_regular(block)
+
+        # Nothing below can fail
+        if not regular:
+            self.irregular[i] = block
+        self.indexes += indexes
+        self.timestamps += timestamps
+        self.hash_versions += hash_versions
+        for (digest, value), buffer, odd in zip(hashes, (self.block_hashes, self.previous_hashes),
+                                                (self.odd_hashes, self.odd_previous)):
+            if isinstance(digest, bytes):
+                buffer += digest
+            else:
+                buffer += NO_DIGEST
+                odd[i] = value
+        self.product_codes += product_codes
+        self.manufacturer_codes += manufacturer_codes
+        self.digests += digests
+        for digest, first in recent.items():
+            self.recent.setdefault(digest, first)
+        self.odd_barcodes.update(odd_barcodes)
+        for barcode, first in odd_barcode_positions.items():
+            self.odd_barcode_positions.setdefault(barcode, first)
+        self.block_offsets.append(position)
+
+    # --- barcode lookup -------------------------------------------------
+
+    # Fold the recently appended products into the sorted prefix table.
+    # Both runs are sorted already, so the stable sort is a linear merge.
+    def _merge(self):
+        if not self.recent:
+            return
+        positions = np.fromiter(sorted(self.recent.values()), dtype=np.int64, count=len(self.recent))
+        records = np.frombuffer(self.digests, dtype=">u8").reshape(-1, DIGEST_SIZE // 8)
+        keys = records[positions, 0].astype(np.uint64)
+        del records  # release the view, the bytearray can't grow while it exists
+        order = np.argsort(keys, kind="stable")
+        keys = np.concatenate((self.sorted_keys, keys[order]))
+        positions = np.concatenate((self.sorted_positions, positions[order]))
+        order = np.argsort(keys, kind="stable")
+        self.sorted_keys = keys[order]
+        self.sorted_positions = positions[order]
+        self.recent = {}
+
+    def _digest_at(self, position):
+        return bytes(self.digests[position * DIGEST_SIZE:(position + 1) * DIGEST_SIZE])
+
+    # Product position of a barcode hash, or None
+    def find_product(self, barcode_hash):
+        digest = chain_model.pack_hash(barcode_hash)
+        with self.lock:
+            if not isinstance(digest, bytes):
+                return self.odd_barcode_positions.get(barcode_hash)
+            position = self.recent.get(digest)
+            if position is not None:
+                return position
+            key = np.uint64(int.from_bytes(digest[:8], "big"))
+            start = np.searchsorted(self.sorted_keys, key, side="left")
+            stop = np.searchsorted(self.sorted_keys, key, side="right")
+            for candidate in self.sorted_positions[start:stop]:
+                if self._digest_at(int(candidate)) == digest:
+                    return int(candidate)
+            return None
+
+    def contains_barcode(self, barcode_hash):
+        return self.find_product(barcode_hash) is not None
+
+    # (block index, position in product_details), like BarcodeIndex.lookup
+    def lookup(self, barcode_hash):
+        position = self.find_product(barcode_hash)
+        if position is None:
+            return None
+        with self.lock:
+            offsets = np.frombuffer(self.block_offsets, dtype=np.int64)
+            block = int(np.searchsorted(offsets, position, side="right")) - 1
+            del offsets
+            return block, position - self.block_offsets[block]
+
+    def product_count(self):
+        return self.block_offsets[-1]
+
+    # --- analytics ------------------------------------------------------
+
+    def manufacturer_counts(self):
+        with self.lock:
+            codes = np.frombuffer(self.manufacturer_codes, dtype=np.int32)
+            counts = np.bincount(codes, minlength=len(self.manufacturers))
+            del codes
+            return {self.manufacturers.values[code]: int(count) for code, count in enumerate(counts) if count}
+
+    def unique_barcodes(self):
+        with self.lock:
+            records = np.frombuffer(self.digests, dtype=f"V{DIGEST_SIZE}")
+            mask = np.ones(len(records), dtype=bool)
+            if self.odd_barcodes:
+                mask[np.fromiter(self.odd_barcodes, dtype=np.int64, count=len(self.odd_barcodes))] = False
+            unique = len(np.unique(records[mask]))
+            del records
+            return unique + len({barcode if barcode is not NO_BARCODE else None
+                                 for barcode in self.odd_barcodes.values()})
+
+    # (bucket start, products) pairs at the finest level with at most
+    # max_points buckets, merging neighbours beyond the widest level
+    def time_series(self, max_points=MAX_CHART_POINTS, bucket_levels=BUCKET_LEVELS):
+        with self.lock:
+            timestamps = np.frombuffer(self.timestamps, dtype=np.float64)
+            products = np.diff(np.frombuffer(self.block_offsets, dtype=np.int64))
+            mask = products > 0
+            timestamps, products = timestamps[mask], products[mask]
+        for seconds in bucket_levels:
+            buckets, inverse = np.unique((np.floor_divide(timestamps, seconds) * seconds).astype(np.int64),
+                                         return_inverse=True)
+            if len(buckets) <= max_points:
+                break
+        counts = np.bincount(inverse, weights=products, minlength=len(buckets)).astype(np.int64)
+        points = list(zip(buckets.tolist(), counts.tolist()))
+        if len(points) <= max_points:
+            return seconds, points
+        group = -(-len(points) // max_points)
+        merged = [(points[i][0], sum(count for _, count in points[i:i + group])) for i in range(0, len(points), group)]
+        return seconds * group, merged
+
+    # Same shape as ChainAnalytics.summary(); recomputed only after appends
+    def summary(self, top_k=TOP_K, max_points=MAX_CHART_POINTS):
+        with self.lock:
+            key = (self.version, top_k, max_points)
+            if self._summary is not None and self._summary[0] == key:
+                return dict(self._summary[1])
+            manufacturer_counts = self.manufacturer_counts()
+            top = sorted(manufacturer_counts.items(), key=lambda item: (-item[1], item[0]))[:top_k]
+            bucket_seconds, time_buckets = self.time_series(max_points)
+            summary = {
+                "version": ("columnar", self.instance, self.version),
+                "blocks": len(self),
+                "product_count": self.product_count(),
+                "unique_barcodes": self.unique_barcodes(),
+                "most_frequent_manufacturer": top[0][0] if top else None,
+                "top_manufacturers": top,
+                "manufacturer_counts": manufacturer_counts,
+                "bucket_seconds": bucket_seconds,
+                "time_buckets": time_buckets,
+            }
+            self._summary = (key, summary)
+            return dict(summary)
+
+    def top_manufacturers(self, k=TOP_K):
+        return self.summary(top_k=k)["top_manufacturers"]
+
+    def nbytes(self):
+        arrays = (self.indexes, self.timestamps, self.block_offsets, self.hash_versions,
+                  self.manufacturer_codes, self.product_codes)
+        return (sum(a.itemsize * len(a) for a in arrays) + len(self.block_hashes) + len(self.previous_hashes)
+                + len(self.digests) + self.sorted_keys.nbytes + self.sorted_positions.nbytes)
+
+
+# BarcodeIndex-compatible view (`in`, lookup, len) over a ColumnarChain.
+# The chain indexes its products as they are appended, so index_block()
+# has nothing left to do.
+class ColumnarBarcodeIndex:
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __len__(self):
+        return self.columns.product_count()
+
+    def __contains__(self, barcode_hash):
+        return self.columns.contains_barcode(barcode_hash)
+
+    def lookup(self, barcode_hash):
+        return self.columns.lookup(barcode_hash)
+
+    def index_block(self, block):
+        pass
+
+
+def from_blocks(blocks):
+    columns = ColumnarChain()
+    columns.extend(blocks)
+    with columns.lock:
+        columns._merge()  # one sort for the whole chain
+    return columns
+
+
+# Build the columnar chain for a JSON chain and report its footprint
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    json_path = argv[0] if argv else "blockchain_data.json"
+    with open(json_path, 'r') as f:
+        blockchain = json.load(f)
+    started = time.perf_counter()
+    columns = from_blocks(blockchain)
+    seconds = time.perf_counter() - started
+    lossless = columns[:] == blockchain
+    print(f"{len(columns)} blocks, {columns.product_count()} products in {columns.nbytes() / 1024:.0f} KiB of arrays "
+          f"(built in {seconds:.3f}s), lossless: {lossless}")
+    return 0 if lossless else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
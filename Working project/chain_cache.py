@@ -0,0 +1,219 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialized within one process
+    fcntl = None
+
+import barcode_filter
+import block_hashing
+import chain_analytics
+import chain_arrays
+import chain_columns
+import chain_index
+import chain_model
+import chain_storage
+
+# Process-wide chain cache
+#
+# Streamlit re-executes the app script on every widget interaction, which
+# used to reload and re-parse the whole chain each time. A SharedChain lives
+# in this (imported, hence cached) module instead, so every session and rerun
+# reuses the same loaded chain, indexes and analytics aggregates. It is reloaded only when the
+# store's signature (file size/mtime, or the chain's generation for SQLite) changed
+# without going through this process; writes made here bump `generation`
+# and update the signature in place.
+#
+# With CHAIN_MODEL=compact the in-memory chain is held as chain_model
+# Block objects (converted block by block on load, and as blocks are
+# committed); with CHAIN_MODEL=columnar it is a chain_arrays.ColumnarChain,
+# which also serves as the barcode index and the analytics aggregates. The
+# stores keep the JSON layout either way.
+#
+# The persisted Bloom filter over the chain's barcodes (barcode_filter) is
+# caught up on load and extended on every commit; contains_barcode() asks it
+# first and only consults the barcode index when it says "maybe".
+#
+# With pyarrow installed, commits also schedule a batched sync of the
+# columnar Parquet snapshot (chain_columns) read by BI tools.
+#
+# Every write path goes through writing(): it holds the chain lock and an
+# exclusive lock on <chain>.write.lock, and refreshes the chain first, so a
+# contains_barcode() check made inside sees every block committed by any
+# session or process, and nobody else can append until the block is
+# committed. Checking a barcode is O(1) (filter + hash index), so a barcode
+# can be registered only once at a cost that doesn't grow with the chain.
+
+
+class SharedChain:
+    def __init__(self, json_path, backend=None, model=None):
+        self.json_path = json_path
+        self.model = model or chain_model.CHAIN_MODEL
+        self.write_lock_path = f"{os.path.splitext(json_path)[0]}.write.lock"
+        self.store = chain_storage.open_storage(json_path, backend)
+        self.lock = threading.RLock()
+        self.writers = 0
+        self.blockchain = []
+        self.barcode_index = chain_index.BarcodeIndex()
+        # (blockchain, barcode_index) replaced in one assignment on reload, so
+        # lock-free readers never pair a new index with the old chain
+        self.indexed = (self.blockchain, self.barcode_index)
+        self.search_index = None
+        self.analytics = chain_analytics.ChainAnalytics()
+        self.barcode_filter = None
+        self.generation = 0
+        self.signature = None
+        self.loaded = False
+
+    def _load(self):
+        if not self.store.exists() and os.path.exists(self.json_path):
+            # Convert the legacy JSON chain to the configured store once
+            chain_storage.migrate_json_chain(self.json_path, self.store)
+        blockchain = self.store.load()
+        if not blockchain:
+            # Create a genesis block if no chain exists yet
+            genesis_block = {
+                "index": 0,
+                "timestamp": time.time(),
+                "product_details": [],
+                "previous_hash": "0",
+                "hash": "genesis_block"
+            }
+            blockchain.append(genesis_block)
+            self.store.append(genesis_block)
+
+        if self.model == "columnar":
+            blockchain = chain_arrays.from_blocks(blockchain)
+            barcode_index = chain_arrays.ColumnarBarcodeIndex(blockchain)
+            analytics = blockchain
+        else:
+            barcode_index = chain_index.BarcodeIndex()
+            # Built once per load; rebuilding from the chain is cheaper than
+            # reading back a persisted copy of the index
+            barcode_index.build(blockchain)
+            analytics = chain_analytics.ChainAnalytics()
+            analytics.build(blockchain)
+            if self.model == "compact":
+                chain_model.compact_chain(blockchain)
+        self.blockchain = blockchain
+        self.barcode_index = barcode_index
+        self.indexed = (blockchain, barcode_index)
+        self.analytics = analytics
+        self.search_index = None
+        self.barcode_filter = barcode_filter.get_filter(barcode_filter.filter_path_for(self.json_path))
+        self.barcode_filter.sync(blockchain)
+        self.signature = self.store.signature()
+        self.generation += 1
+        self.loaded = True
+
+    # Cheap on the common path: one stat (or primary-key lookup) per call
+    def refresh(self):
+        with self.lock:
+            if self.loaded and self.store.signature() == self.signature:
+                return False
+            self._load()
+            return True
+
+    # False means the barcode is definitely not registered
+    def might_contain(self, barcode_hash):
+        return self.barcode_filter is None or barcode_hash in self.barcode_filter
+
+    # Counterfeit scans are usually turned away by the filter alone
+    def contains_barcode(self, barcode_hash):
+        return self.might_contain(barcode_hash) and barcode_hash in self.barcode_index
+
+    # Hold while checking barcodes and appending; yields the up-to-date chain.
+    # Re-entrant within a thread.
+    @contextmanager
+    def writing(self):
+        with self.lock:
+            if self.writers:
+                self.writers += 1
+                try:
+                    yield self.blockchain
+                finally:
+                    self.writers -= 1
+                return
+            lock_file = open(self.write_lock_path, 'a')
+            try:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self.refresh()
+                self.writers = 1
+                try:
+                    yield self.blockchain
+                finally:
+                    self.writers = 0
+            finally:
+                lock_file.close()
+
+    # Register one product in a block of its own; returns the block, or None
+    # when the barcode is already on the chain
+    def add_product(self, product_details, barcode_hash):
+        with self.writing() as blockchain:
+            if self.contains_barcode(barcode_hash):
+                return None
+            previous_block = blockchain[-1]
+            block = {
+                "index": len(blockchain),
+                "timestamp": time.time(),
+                "product_details": [{"product": product_details, "barcode_hash": barcode_hash}],
+                "previous_hash": previous_block["hash"],
+                "hash_version": block_hashing.HASH_VERSION,
+                "hash": "temporary_placeholder"
+            }
+            block["hash"] = block_hashing.compute_block_hash(block)
+            # Written to the store first, so a failed write leaves the
+            # in-memory chain unchanged
+            self.store.append(block)
+            blockchain.append(block)
+            self.committed(block)
+            return block
+
+    # The search index is only built for apps that actually search
+    def get_search_index(self):
+        with self.lock:
+            if self.search_index is None:
+                search_index = chain_index.SearchIndex()
+                search_index.build(self.blockchain)
+                self.search_index = search_index
+            return self.search_index
+
+    # Call after a block was written to the store through this process
+    def committed(self, block):
+        with self.lock:
+            if self.model == "columnar":
+                # Appending to the columnar chain indexed and counted it already
+                if len(self.blockchain) <= block["index"]:
+                    self.blockchain.append(block)
+            else:
+                index = block["index"]
+                if self.model == "compact" and index < len(self.blockchain) and self.blockchain[index] is block:
+                    self.blockchain[index] = chain_model.to_compact(block)
+                self.barcode_index.index_block(block)
+                self.analytics.add_block(block)
+            if self.search_index is not None:
+                self.search_index.index_block(block)
+            if self.barcode_filter is not None:
+                self.barcode_filter.sync(self.blockchain)
+            if chain_columns.available():
+                snapshot = chain_columns.get_snapshot(chain_columns.columns_dir_for(self.json_path))
+                snapshot.sync_later(lambda: self.blockchain)
+            self.signature = self.store.signature()
+            self.generation += 1
+
+
+_shared_chains = {}
+_registry_lock = threading.Lock()
+
+
+def get_shared_chain(json_path, backend=None):
+    with _registry_lock:
+        key = (os.path.abspath(json_path), backend or chain_storage.STORAGE_BACKEND)
+        shared_chain = _shared_chains.get(key)
+        if shared_chain is None:
+            shared_chain = _shared_chains[key] = SharedChain(json_path, backend)
+        return shared_chain
@@ -0,0 +1,298 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: syncs are only serialized within one process
+    fcntl = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # the snapshot is optional, callers fall back to the block dicts
+    pa = None
+    pq = None
+
+import chain_storage
+
+# Columnar snapshot of the chain
+#
+# Analytics and visualize_blockchain flatten the nested block dicts into
+# Python lists of rows before handing them to pandas. This module keeps the
+# same data as one row per product in Parquet files instead:
+#
+#   block_index, timestamp, previous_hash, block_hash, position,
+#   product_name, manufacturer_name, barcode_hash
+#
+# with the repetitive string columns (hashes shared by a block's products,
+# product and manufacturer names) dictionary-encoded. The snapshot is a
+# directory of part files plus a _manifest.json naming the live parts and
+# the last block they cover. sync() only converts blocks appended since the
+# last call into a new part (and rebuilds if the chain was rewritten), and
+# parts are merged once there are more than MAX_PARTS of them. Tables are
+# read with memory mapping; BI tools can read the part files listed in the
+# manifest directly.
+#
+# chain_cache.SharedChain calls sync_later() on every commit: the first
+# commit starts a timer and the blocks committed until it fires (SYNC_DELAY
+# seconds) are converted together into one part, so the snapshot trails the
+# chain by a few seconds without writing a Parquet file per block.
+# Short-lived writers (bulk_import) call sync() before they exit.
+#
+# Every process writing the snapshot takes an exclusive lock on
+# <chain>.columns.lock and re-reads the manifest under it, so part names
+# and manifest updates from different processes never collide.
+
+MANIFEST_FILE = "_manifest.json"
+PART_PREFIX = "part-"
+MAX_PARTS = 32
+SYNC_DELAY = 5.0
+LOCK_SUFFIX = ".lock"
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ["block_index", "timestamp", "previous_hash", "block_hash", "position",
+           "product_name", "manufacturer_name", "barcode_hash"]
+DICTIONARY_COLUMNS = {"previous_hash", "block_hash", "product_name", "manufacturer_name"}
+
+
+def available():
+    return pa is not None
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("The columnar chain snapshot requires pyarrow (pip install pyarrow)")
+
+
+def columns_dir_for(json_path):
+    return f"{os.path.splitext(json_path)[0]}.columns"
+
+
+def schema():
+    _require_pyarrow()
+    text = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ("block_index", pa.int64()),
+        ("timestamp", pa.float64()),
+        ("previous_hash", text),
+        ("block_hash", text),
+        ("position", pa.int32()),
+        ("product_name", text),
+        ("manufacturer_name", text),
+        ("barcode_hash", pa.string()),
+    ])
+
+
+# One row per product of the given blocks
+def blocks_to_table(blocks):
+    _require_pyarrow()
+    columns = {name: [] for name in COLUMNS}
+    for block in blocks:
+        for position, product in enumerate(block["product_details"]):
+            columns["block_index"].append(block["index"])
+            columns["timestamp"].append(block["timestamp"])
+            columns["previous_hash"].append(block["previous_hash"])
+            columns["block_hash"].append(block["hash"])
+            columns["position"].append(position)
+            columns["product_name"].append(product["product"]["product_name"])
+            columns["manufacturer_name"].append(product["product"]["manufacturer_name"])
+            columns["barcode_hash"].append(product.get("barcode_hash"))
+
+    table_schema = schema()
+    arrays = []
+    for field in table_schema:
+        if field.name in DICTIONARY_COLUMNS:
+            arrays.append(pa.array(columns[field.name], pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(columns[field.name], field.type))
+    return pa.Table.from_arrays(arrays, schema=table_schema)
+
+
+class ColumnarSnapshot:
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, MANIFEST_FILE)
+        self.lock_path = directory.rstrip("/\\") + LOCK_SUFFIX
+        self.lock = threading.Lock()
+        self.timer = None
+        self.manifest = self._load_manifest()
+
+    def _empty_manifest(self):
+        return {"blocks": 0, "tip_hash": None, "rows": 0, "parts": [], "next_part": 0}
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return self._empty_manifest()
+
+    # Serializes writers across processes (where fcntl exists); the caller
+    # holds self.lock. The manifest is re-read so another process's parts count.
+    @contextmanager
+    def _locked(self):
+        lock_file = open(self.lock_path, 'a')
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self.manifest = self._load_manifest()
+            yield
+        finally:
+            lock_file.close()
+
+    def _save_manifest(self):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _part_path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _write_part(self, table):
+        name = f"{PART_PREFIX}{self.manifest['next_part']:06d}.parquet"
+        self.manifest["next_part"] += 1
+        tmp_path = self._part_path(name) + ".tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, self._part_path(name))
+        return name
+
+    def _remove_parts(self, names):
+        for name in names:
+            try:
+                os.remove(self._part_path(name))
+            except FileNotFoundError:
+                pass
+
+    # Bring the snapshot up to date with `blockchain`; returns the number of
+    # blocks converted
+    def sync(self, blockchain):
+        _require_pyarrow()
+        with self.lock, self._locked():
+            covered = self.manifest["blocks"]
+            if covered > len(blockchain) or (covered and blockchain[covered - 1]["hash"] != self.manifest["tip_hash"]):
+                # The chain was rewritten or replaced, start over
+                old_parts = self.manifest["parts"]
+                self.manifest = dict(self._empty_manifest(), next_part=self.manifest["next_part"])
+                self._save_manifest()
+                self._remove_parts(old_parts)
+                covered = 0
+            # Blocks appended while converting are left for the next sync
+            blocks = blockchain[covered:]
+            if not blocks:
+                return 0
+
+            os.makedirs(self.directory, exist_ok=True)
+            table = blocks_to_table(blocks)
+            if table.num_rows:
+                self.manifest["parts"].append(self._write_part(table))
+                self.manifest["rows"] += table.num_rows
+            self.manifest["blocks"] = covered + len(blocks)
+            self.manifest["tip_hash"] = blocks[-1]["hash"]
+            self._save_manifest()
+            if len(self.manifest["parts"]) > MAX_PARTS:
+                self._compact()
+            return len(blocks)
+
+    # Sync with the chain returned by get_chain() in `delay` seconds, unless
+    # a sync is already scheduled (it will pick up the new blocks too)
+    def sync_later(self, get_chain, delay=SYNC_DELAY):
+        with self.lock:
+            if self.timer is not None:
+                return
+            self.timer = threading.Timer(delay, self._scheduled_sync, (get_chain,))
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _scheduled_sync(self, get_chain):
+        with self.lock:
+            self.timer = None
+        try:
+            self.sync(get_chain())
+        except Exception:
+            logger.exception("Error syncing the columnar snapshot")
+
+    # Merge every part into one file
+    def _compact(self):
+        old_parts = self.manifest["parts"]
+        table = self._read(old_parts)
+        self.manifest["parts"] = [self._write_part(table)]
+        self._save_manifest()
+        self._remove_parts(old_parts)
+
+    def compact(self):
+        _require_pyarrow()
+        with self.lock, self._locked():
+            if len(self.manifest["parts"]) > 1:
+                self._compact()
+
+    def _read(self, parts, columns=None, filters=None):
+        table_schema = schema()
+        if not parts:
+            return table_schema.empty_table().select(columns or COLUMNS)
+        tables = [pq.read_table(self._part_path(name), columns=columns, filters=filters,
+                                memory_map=True, schema=table_schema)
+                  for name in parts]
+        return pa.concat_tables(tables, promote_options="permissive")
+
+    # Read the snapshot (optionally only some columns / rows matching pyarrow
+    # filters such as [("manufacturer_name", "=", "Acme")])
+    def table(self, columns=None, filters=None):
+        _require_pyarrow()
+        with self.lock:
+            self.manifest = self._load_manifest()
+            parts = list(self.manifest["parts"])
+        return self._read(parts, columns, filters)
+
+    def part_paths(self):
+        with self.lock:
+            self.manifest = self._load_manifest()
+            return [self._part_path(name) for name in self.manifest["parts"]]
+
+
+_snapshots = {}
+_registry_lock = threading.Lock()
+
+
+# One snapshot object per directory for the whole process
+def get_snapshot(directory):
+    with _registry_lock:
+        key = os.path.abspath(directory)
+        snapshot = _snapshots.get(key)
+        if snapshot is None:
+            snapshot = _snapshots[key] = ColumnarSnapshot(directory)
+        return snapshot
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write or update the columnar (Parquet) snapshot of a chain.")
+    parser.add_argument("--chain", default="blockchain_data.json", help="blockchain JSON file (its configured store is used when present)")
+    parser.add_argument("--out", default=None, help="snapshot directory (default: <chain>.columns)")
+    parser.add_argument("--compact", action="store_true", help="merge all parts into one file")
+    args = parser.parse_args(argv)
+
+    if not available():
+        print("pyarrow is not installed (pip install pyarrow)")
+        return 1
+    snapshot = get_snapshot(args.out or columns_dir_for(args.chain))
+    blockchain = chain_storage.read_chain(args.chain)
+    started = time.perf_counter()
+    converted = snapshot.sync(blockchain)
+    if args.compact:
+        snapshot.compact()
+    manifest = snapshot.manifest
+    print(f"{converted} new blocks converted in {time.perf_counter() - started:.3f}s; snapshot covers "
+          f"{manifest['blocks']} blocks, {manifest['rows']} products in {len(manifest['parts'])} part(s) "
+          f"at {snapshot.directory}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+import bisect
+import itertools
+import threading
+
+# Paginated chain explorer
+#
+# The visualization pages used to turn every block (and every product) into
+# one table or one HTML box per block. A ChainExplorer answers "which blocks
+# match, and what is on page N" instead, so only one page of blocks is read
+# from storage and rendered.
+#
+# The source is anything with len() and read_range(start, stop): a chain
+# store from chain_storage, or print_chain's demo Blockchain. Filters:
+#   block_index   - one block
+#   hash_prefix   - blocks whose hash starts with the prefix (sorted hash
+#                   list + bisect)
+#   manufacturer  - blocks holding a product of that manufacturer
+# The filter indexes are built from the source in chunks the first time
+# they are needed and then only extended with the blocks appended since.
+# Unfiltered pages are a single read_range over the page's index range.
+
+PAGE_SIZE = 20
+SCAN_CHUNK = 1000
+
+
+# Blocks are dicts in the stores and objects in print_chain's demo chain
+def block_value(block, key):
+    return block[key] if isinstance(block, dict) else getattr(block, key)
+
+
+def block_manufacturers(block):
+    if not isinstance(block, dict):
+        return set()
+    return {product["product"]["manufacturer_name"] for product in block["product_details"]}
+
+
+class ChainExplorer:
+    def __init__(self, source, scan_chunk=SCAN_CHUNK):
+        self.source = source
+        self.scan_chunk = scan_chunk
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.covered = 0
+        self.tip_hash = None
+        self.hashes = []            # sorted (hash, block index)
+        self.manufacturers = {}     # manufacturer -> ascending block indexes
+
+    def _index(self, blocks, new_hashes):
+        for block in blocks:
+            index = block_value(block, "index")
+            new_hashes.append((block_value(block, "hash"), index))
+            for manufacturer in block_manufacturers(block):
+                self.manufacturers.setdefault(manufacturer, []).append(index)
+            self.tip_hash = block_value(block, "hash")
+        self.covered += len(blocks)
+
+    # Extend the filter indexes with blocks appended since the last call
+    # (start over if the indexed part of the chain was rewritten)
+    def sync(self):
+        with self.lock:
+            length = len(self.source)
+            if self.covered:
+                last = self.source.read_range(self.covered - 1, self.covered)
+                if self.covered > length or not last or block_value(last[0], "hash") != self.tip_hash:
+                    self._reset()
+            new_hashes = []
+            while self.covered < length:
+                blocks = self.source.read_range(self.covered, min(self.covered + self.scan_chunk, length))
+                if not blocks:
+                    break
+                self._index(blocks, new_hashes)
+            if new_hashes:
+                # Two sorted runs, which sort() merges in linear time
+                new_hashes.sort()
+                self.hashes.extend(new_hashes)
+                self.hashes.sort()
+
+    # Matching block indexes, ascending. Without filters this is a range,
+    # so nothing is scanned.
+    def find(self, block_index=None, hash_prefix=None, manufacturer=None):
+        length = len(self.source)
+        if block_index is None and not hash_prefix and not manufacturer:
+            return range(length)
+
+        self.sync()
+        with self.lock:
+            matches = None
+            if block_index is not None:
+                matches = {block_index} if 0 <= block_index < length else set()
+            if hash_prefix:
+                hash_prefix = hash_prefix.lower()
+                start = bisect.bisect_left(self.hashes, (hash_prefix,))
+                found = set()
+                for block_hash, index in itertools.islice(self.hashes, start, None):
+                    if not block_hash.startswith(hash_prefix):
+                        break
+                    found.add(index)
+                matches = found if matches is None else matches & found
+            if manufacturer:
+                found = set(self.manufacturers.get(manufacturer, []))
+                matches = found if matches is None else matches & found
+        return sorted(matches)
+
+    def _read(self, indexes):
+        if not indexes:
+            return []
+        if indexes[-1] - indexes[0] + 1 == len(indexes):
+            return self.source.read_range(indexes[0], indexes[-1] + 1)
+        blocks = []
+        for index in indexes:
+            blocks.extend(self.source.read_range(index, index + 1))
+        return blocks
+
+    # One page of matching blocks plus the totals for the page controls.
+    # `page` is clamped to the available pages.
+    def page(self, page=0, page_size=PAGE_SIZE, block_index=None, hash_prefix=None, manufacturer=None):
+        matches = self.find(block_index, hash_prefix, manufacturer)
+        pages = max(1, -(-len(matches) // page_size))
+        page = min(max(page, 0), pages - 1)
+        indexes = list(matches[page * page_size:(page + 1) * page_size])
+        return {"blocks": self._read(indexes), "total": len(matches), "page": page, "pages": pages}
+
+
+_explorers = {}
+_registry_lock = threading.Lock()
+
+
+# One explorer per chain store for the whole process
+def get_explorer(store):
+    with _registry_lock:
+        explorer = _explorers.get(store.path)
+        if explorer is None or explorer.source is not store:
+            explorer = _explorers[store.path] = ChainExplorer(store)
+        return explorer
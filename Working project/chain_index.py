@@ -0,0 +1,121 @@
+import bisect
+import itertools
+
+# In-memory indexes over the blockchain
+#
+# BarcodeIndex maps barcode_hash -> (block index, position in product_details)
+# so verify_barcode_in_blockchain no longer has to walk the whole chain.
+# SearchIndex keeps secondary indexes on manufacturer and product names for
+# the user dashboard search. Both are updated by add_block as products arrive.
+
+
+class BarcodeIndex:
+    def __init__(self):
+        self.positions = {}
+        self.blocks_indexed = 0
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, barcode_hash):
+        return barcode_hash in self.positions
+
+    def lookup(self, barcode_hash):
+        return self.positions.get(barcode_hash)
+
+    def add(self, barcode_hash, block_index, position):
+        if barcode_hash is not None:
+            self.positions[barcode_hash] = (block_index, position)
+
+    def index_block(self, block):
+        for position, product in enumerate(block["product_details"]):
+            self.add(product.get("barcode_hash"), block["index"], position)
+        self.blocks_indexed = max(self.blocks_indexed, block["index"] + 1)
+
+    def build(self, blockchain):
+        self.positions = {}
+        self.blocks_indexed = 0
+        for block in blockchain:
+            self.index_block(block)
+
+
+# Columns of the rows returned by SearchIndex.search
+SEARCH_COLUMNS = ["Product Name", "Manufacturer", "Barcode Hash"]
+
+SEARCH_FIELDS = {
+    "Manufacturer Name": "manufacturer_name",
+    "Product Name": "product_name",
+}
+
+
+# Exact, case-insensitive and prefix lookups on one product field.
+# Rows are shared (product_name, manufacturer_name, barcode_hash) tuples.
+class FieldIndex:
+    def __init__(self):
+        self.exact = {}
+        self.folded = {}
+        self.sorted_keys = []  # folded keys in order, for prefix lookups
+
+    # `keep_sorted=False` leaves sorted_keys to a single sort_keys() call
+    # (bulk builds); otherwise each new key is inserted in order
+    def add(self, value, row, keep_sorted=True):
+        self.exact.setdefault(value, []).append(row)
+        key = value.casefold()
+        rows = self.folded.get(key)
+        if rows is None:
+            rows = self.folded[key] = []
+            if keep_sorted:
+                bisect.insort(self.sorted_keys, key)
+        rows.append(row)
+
+    def sort_keys(self):
+        self.sorted_keys = sorted(self.folded)
+
+    def lookup(self, term):
+        return self.exact.get(term, [])
+
+    def lookup_casefold(self, term):
+        return self.folded.get(term.casefold(), [])
+
+    def lookup_prefix(self, prefix):
+        prefix = prefix.casefold()
+        results = []
+        start = bisect.bisect_left(self.sorted_keys, prefix)
+        for key in itertools.islice(self.sorted_keys, start, None):
+            if not key.startswith(prefix):
+                break
+            results.extend(self.folded[key])
+        return results
+
+
+# Secondary indexes on manufacturer_name and product_name for user_dashboard search
+class SearchIndex:
+    def __init__(self):
+        self.fields = {field: FieldIndex() for field in SEARCH_FIELDS.values()}
+
+    def add(self, product_details, barcode_hash, keep_sorted=True):
+        row = (product_details["product_name"], product_details["manufacturer_name"], barcode_hash)
+        for field, field_index in self.fields.items():
+            field_index.add(product_details[field], row, keep_sorted)
+
+    def index_block(self, block, keep_sorted=True):
+        for product in block["product_details"]:
+            self.add(product["product"], product.get("barcode_hash"), keep_sorted)
+
+    # Fill the dicts first and sort each field's keys once at the end
+    def build(self, blockchain):
+        self.fields = {field: FieldIndex() for field in SEARCH_FIELDS.values()}
+        for block in blockchain:
+            self.index_block(block, keep_sorted=False)
+        for field_index in self.fields.values():
+            field_index.sort_keys()
+
+    # search_type is one of the SEARCH_FIELDS labels shown in the dashboard;
+    # match is "Exact", "Case-insensitive" or "Prefix"
+    def search(self, search_type, term, match="Exact"):
+        field_index = self.fields[SEARCH_FIELDS[search_type]]
+        if match == "Prefix":
+            return field_index.lookup_prefix(term)
+        if match == "Case-insensitive":
+            return field_index.lookup_casefold(term)
+        return field_index.lookup(term)
@@ -0,0 +1,295 @@
+import argparse
+import array
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+import chain_model
+import chain_storage
+
+# Memory-mapped chain file for verification workers
+#
+# Every verification process used to load the whole chain and build its own
+# barcode index. A chain file holds what verification needs in a fixed binary
+# layout that workers mmap read-only, so any number of processes share one
+# copy in the OS page cache and opening it costs a header read:
+#
+#   header          magic, format version, counts, section offsets, tip hash
+#   blocks          block_count + 1 uint64: first product of every block
+#   products        product_count records of two uint32 string codes
+#                   (product name, manufacturer name)
+#   digests         sorted (32-byte barcode digest, uint64 product) records
+#   strings         string_count + 1 uint64 offsets, then the UTF-8 data
+#   meta            JSON: source store signature and the barcodes that are
+#                   not 64-char hex hashes ({barcode: product})
+#
+# All integers are little-endian; sections start on 8-byte boundaries.
+# Barcode lookups binary-search the digest table straight from the mapping.
+# Files are written to a temporary name and renamed into place, so a worker
+# keeps reading its old mapping until refresh() sees the new file.
+
+MAGIC = b"ACHAIN01"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sIIQQQQQQQQQ64s")
+BLOCK_OFFSET = struct.Struct("<Q")
+PRODUCT = struct.Struct("<II")
+DIGEST_ENTRY = struct.Struct("<32sQ")
+DIGEST_SIZE = 32
+
+
+def chain_file_for(json_path):
+    return f"{os.path.splitext(json_path)[0]}.chain"
+
+
+def _align(f):
+    padding = -f.tell() % 8
+    if padding:
+        f.write(b"\0" * padding)
+    return f.tell()
+
+
+# Write the chain file for `blocks` (any iterable of block dicts)
+def write_chain_file(blocks, path, signature=None):
+    block_offsets = array.array('Q', [0])
+    product_codes = array.array('I')
+    digests = bytearray()
+    digest_products = array.array('Q')
+    strings = {}
+    odd_barcodes = {}
+    tip_hash = ""
+
+    def code(value):
+        if value not in strings:
+            strings[value] = len(strings)
+        return strings[value]
+
+    position = 0
+    for block in blocks:
+        for product in block["product_details"]:
+            details = product["product"]
+            product_codes.append(code(details["product_name"] or ""))
+            product_codes.append(code(details["manufacturer_name"] or ""))
+            barcode_hash = product.get("barcode_hash")
+            digest = chain_model.pack_hash(barcode_hash)
+            if isinstance(digest, bytes):
+                digests += digest
+                digest_products.append(position)
+            elif barcode_hash is not None:
+                odd_barcodes.setdefault(barcode_hash, position)
+            position += 1
+        block_offsets.append(position)
+        tip_hash = block["hash"]
+
+    # Sort the digests as big-endian 64-bit words, most significant first
+    # (the same order as comparing the raw bytes)
+    words = np.frombuffer(bytes(digests), dtype=">u8").reshape(-1, DIGEST_SIZE // 8)
+    order = np.lexsort(words.T[::-1]) if len(words) else np.empty(0, dtype=np.int64)
+    table = np.empty(len(order), dtype=[("digest", f"V{DIGEST_SIZE}"), ("product", "<u8")])
+    table["digest"] = np.frombuffer(bytes(digests), dtype=f"V{DIGEST_SIZE}")[order]
+    table["product"] = np.frombuffer(digest_products, dtype=np.uint64)[order]
+
+    encoded = [value.encode() for value in strings]
+    string_offsets = array.array('Q', [0])
+    for value in encoded:
+        string_offsets.append(string_offsets[-1] + len(value))
+    meta = json.dumps({"signature": list(signature) if signature else None,
+                       "odd_barcodes": odd_barcodes}).encode()
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(b"\0" * HEADER.size)
+        blocks_offset = _align(f)
+        f.write(np.frombuffer(block_offsets, dtype=np.uint64).astype("<u8").tobytes())
+        products_offset = _align(f)
+        f.write(np.frombuffer(product_codes, dtype=np.uint32).astype("<u4").tobytes())
+        digests_offset = _align(f)
+        f.write(table.tobytes())
+        strings_offset = _align(f)
+        f.write(np.frombuffer(string_offsets, dtype=np.uint64).astype("<u8").tobytes())
+        f.write(b"".join(encoded))
+        meta_offset = _align(f)
+        f.write(meta)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(block_offsets) - 1, position, len(table),
+                            len(encoded), blocks_offset, products_offset, digests_offset, strings_offset,
+                            meta_offset, tip_hash.encode()[:64]))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return path
+
+
+class ChainFile:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self._open()
+
+    def _open(self):
+        with open(self.path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, _, block_count, product_count, digest_count, string_count, blocks_offset,
+         products_offset, digests_offset, strings_offset, meta_offset, tip_hash) = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{self.path} is not a chain file (or was written by another version)")
+        meta = json.loads(data[meta_offset:])
+        # Swapped in one assignment so concurrent lookups see either file, never a mix
+        self.state = {
+            "map": data,
+            "identity": (stat.st_ino, stat.st_mtime_ns, stat.st_size),
+            "block_count": block_count,
+            "product_count": product_count,
+            "digest_count": digest_count,
+            "string_count": string_count,
+            "blocks_offset": blocks_offset,
+            "products_offset": products_offset,
+            "digests_offset": digests_offset,
+            "strings_offset": strings_offset,
+            "tip_hash": tip_hash.rstrip(b"\0").decode(),
+            "signature": meta["signature"],
+            "odd_barcodes": meta["odd_barcodes"],
+        }
+
+    # Map the file again if it was replaced; returns True when it was. The
+    # old mapping is left to the garbage collector, so lookups still running
+    # on it are not cut off.
+    def refresh(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        with self.lock:
+            if (stat.st_ino, stat.st_mtime_ns, stat.st_size) == self.state["identity"]:
+                return False
+            self._open()
+            return True
+
+    def __len__(self):
+        state = self.state
+        return state["digest_count"] + len(state["odd_barcodes"])
+
+    @property
+    def block_count(self):
+        return self.state["block_count"]
+
+    @property
+    def tip_hash(self):
+        return self.state["tip_hash"]
+
+    @property
+    def signature(self):
+        return self.state["signature"]
+
+    def _find(self, state, barcode_hash):
+        digest = chain_model.pack_hash(barcode_hash)
+        if not isinstance(digest, bytes):
+            return state["odd_barcodes"].get(barcode_hash)
+        data, base = state["map"], state["digests_offset"]
+        lo, hi = 0, state["digest_count"]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = base + mid * DIGEST_ENTRY.size
+            if data[offset:offset + DIGEST_SIZE] < digest:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < state["digest_count"]:
+            found, product = DIGEST_ENTRY.unpack_from(data, base + lo * DIGEST_ENTRY.size)
+            if found == digest:
+                return product
+        return None
+
+    def __contains__(self, barcode_hash):
+        return self._find(self.state, barcode_hash) is not None
+
+    def _block_of(self, state, product):
+        data, base = state["map"], state["blocks_offset"]
+        lo, hi = 0, state["block_count"]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if BLOCK_OFFSET.unpack_from(data, base + (mid + 1) * BLOCK_OFFSET.size)[0] <= product:
+                lo = mid + 1
+            else:
+                hi = mid
+        first = BLOCK_OFFSET.unpack_from(data, base + lo * BLOCK_OFFSET.size)[0]
+        return lo, product - first
+
+    # (block index, position in product_details), like BarcodeIndex.lookup
+    def lookup(self, barcode_hash):
+        state = self.state
+        product = self._find(state, barcode_hash)
+        return None if product is None else self._block_of(state, product)
+
+    def _string(self, state, code):
+        data, base = state["map"], state["strings_offset"]
+        start, stop = struct.unpack_from("<QQ", data, base + code * 8)
+        text_base = base + (state["string_count"] + 1) * 8
+        return data[text_base + start:text_base + stop].decode()
+
+    def _details(self, state, product):
+        name, manufacturer = PRODUCT.unpack_from(state["map"], state["products_offset"] + product * PRODUCT.size)
+        return {"product_name": self._string(state, name), "manufacturer_name": self._string(state, manufacturer)}
+
+    # bulk_verify resolver: barcode_hash -> product fields for the registered ones
+    def resolve(self, hashes):
+        state = self.state
+        found = {}
+        for barcode_hash in hashes:
+            product = self._find(state, barcode_hash)
+            if product is not None:
+                found[barcode_hash] = self._details(state, product)
+        return found
+
+
+# The store's signature, or the legacy JSON file's before it was migrated
+def source_signature(json_path, backend=None):
+    store = chain_storage.open_storage(json_path, backend)
+    if store.exists():
+        return store.signature()
+    try:
+        stat = os.stat(json_path)
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+# Rewrite the chain file when the store changed since it was written.
+# Returns True when a new file was written.
+def sync_chain_file(json_path, path=None, backend=None):
+    path = path or chain_file_for(json_path)
+    signature = source_signature(json_path, backend)
+    if signature is not None and os.path.exists(path):
+        try:
+            if ChainFile(path).signature == list(signature):
+                return False
+        except (OSError, ValueError):
+            pass
+    write_chain_file(chain_storage.read_chain(json_path, backend), path, signature)
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write the memory-mapped chain file used by verification workers.")
+    parser.add_argument("--chain", default="blockchain_data.json", help="blockchain JSON file (its configured store is used when present)")
+    parser.add_argument("--out", default=None, help="chain file (default: <chain>.chain)")
+    args = parser.parse_args(argv)
+
+    path = args.out or chain_file_for(args.chain)
+    started = time.perf_counter()
+    written = sync_chain_file(args.chain, path)
+    chain_file = ChainFile(path)
+    print(f"{'Wrote' if written else 'Up to date:'} {path}: {chain_file.block_count} blocks, "
+          f"{len(chain_file)} barcodes, {os.path.getsize(path) / 1024:.0f} KiB "
+          f"({time.perf_counter() - started:.3f}s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+# Compact chain object model
+#
+# The chain is normally held as a list of dicts of lists of dicts, so every
+# product costs two dicts plus its own copies of the key and name strings.
+# Block and Product keep the same data in __slots__ objects instead:
+#   - product and manufacturer names are interned (one string per distinct name)
+#   - barcode hashes and block hashes that are 64-char lowercase hex are kept
+#     as 32-byte digests; anything else ("genesis_block", "0") is kept as is
+#   - a block's products stay a list, so repr(block["product_details"]) is
+#     the same text the legacy hash was computed over
+#
+# Conversion is lossless: Block.from_dict(block).to_dict() == block, key
+# order included (unknown keys are carried along in `extra`). Blocks and
+# products also answer the dict lookups the rest of the code uses
+# (block["product_details"], product["product"]["manufacturer_name"],
+# product.get("barcode_hash"), ...), and Product's repr is the dict repr, so
+# legacy block hashes computed over a compact block come out the same.
+#
+# chain_cache holds the shared chain in this model when CHAIN_MODEL=compact.
+
+CHAIN_MODEL = os.environ.get("CHAIN_MODEL", "dict")
+
+BLOCK_KEYS = ("index", "timestamp", "product_details", "previous_hash", "hash_version", "hash")
+
+_MISSING = object()
+
+
+def pack_hash(value):
+    if isinstance(value, str) and len(value) == 64:
+        try:
+            digest = bytes.fromhex(value)
+        except ValueError:
+            return value
+        if len(digest) == 32 and digest.hex() == value:
+            return digest
+    return value
+
+
+def unpack_hash(value):
+    return value.hex() if isinstance(value, bytes) else value
+
+
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+class Product:
+    __slots__ = ("product_name", "manufacturer_name", "barcode", "extra")
+
+    def __init__(self, product_name, manufacturer_name, barcode_hash=_MISSING, extra=None):
+        self.product_name = _intern(product_name)
+        self.manufacturer_name = _intern(manufacturer_name)
+        self.barcode = barcode_hash if barcode_hash is _MISSING else pack_hash(barcode_hash)
+        self.extra = extra
+
+    @property
+    def barcode_hash(self):
+        return None if self.barcode is _MISSING else unpack_hash(self.barcode)
+
+    @property
+    def digest(self):
+        return self.barcode if isinstance(self.barcode, bytes) else None
+
+    @classmethod
+    def from_dict(cls, product):
+        details = product["product"]
+        extra = None
+        if len(product) > 2 or len(details) > 2 or "barcode_hash" not in product and len(product) > 1:
+            extra = {
+                "product": {key: value for key, value in details.items() if key not in ("product_name", "manufacturer_name")},
+                "outer": {key: value for key, value in product.items() if key not in ("product", "barcode_hash")},
+            }
+        return cls(details["product_name"], details["manufacturer_name"],
+                   product.get("barcode_hash", _MISSING), extra)
+
+    def details(self):
+        details = {"product_name": self.product_name, "manufacturer_name": self.manufacturer_name}
+        if self.extra:
+            details.update(self.extra["product"])
+        return details
+
+    def to_dict(self):
+        product = {"product": self.details()}
+        if self.barcode is not _MISSING:
+            product["barcode_hash"] = unpack_hash(self.barcode)
+        if self.extra:
+            product.update(self.extra["outer"])
+        return product
+
+    # Read-only dict access for code written against the JSON layout
+    def __getitem__(self, key):
+        if key == "product":
+            return self.details()
+        if key == "barcode_hash" and self.barcode is not _MISSING:
+            return unpack_hash(self.barcode)
+        if self.extra and key in self.extra["outer"]:
+            return self.extra["outer"][key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __eq__(self, other):
+        if isinstance(other, (Product, dict)):
+            return self.to_dict() == (other.to_dict() if isinstance(other, Product) else other)
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+class Block:
+    __slots__ = ("index", "timestamp", "products", "previous", "digest", "hash_version", "extra")
+
+    def __init__(self, index, timestamp, products, previous_hash, block_hash, hash_version=None, extra=None):
+        self.index = index
+        self.timestamp = timestamp
+        self.products = list(products)
+        self.previous = pack_hash(previous_hash)
+        self.digest = pack_hash(block_hash)
+        self.hash_version = hash_version
+        self.extra = extra
+
+    @property
+    def previous_hash(self):
+        return unpack_hash(self.previous)
+
+    @property
+    def hash(self):
+        return unpack_hash(self.digest)
+
+    @classmethod
+    def from_dict(cls, block):
+        extra = None
+        if any(key not in BLOCK_KEYS for key in block):
+            # Unknown keys, with their position, so to_dict() restores the order
+            extra = [(position, key, value) for position, (key, value) in enumerate(block.items())
+                     if key not in BLOCK_KEYS]
+        return cls(block["index"], block["timestamp"],
+                   [Product.from_dict(product) for product in block["product_details"]],
+                   block["previous_hash"], block["hash"], block.get("hash_version"), extra)
+
+    def to_dict(self):
+        block = {
+            "index": self.index,
+            "timestamp": self.timestamp,
+            "product_details": [product.to_dict() for product in self.products],
+            "previous_hash": unpack_hash(self.previous),
+        }
+        if self.hash_version is not None:
+            block["hash_version"] = self.hash_version
+        block["hash"] = unpack_hash(self.digest)
+        if self.extra:
+            items = list(block.items())
+            for position, key, value in self.extra:
+                items.insert(position, (key, value))
+            block = dict(items)
+        return block
+
+    def __getitem__(self, key):
+        if key == "product_details":
+            return self.products
+        if key in ("index", "timestamp"):
+            return getattr(self, key)
+        if key == "previous_hash":
+            return unpack_hash(self.previous)
+        if key == "hash":
+            return unpack_hash(self.digest)
+        if key == "hash_version" and self.hash_version is not None:
+            return self.hash_version
+        if self.extra:
+            for _, extra_key, value in self.extra:
+                if extra_key == key:
+                    return value
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __eq__(self, other):
+        if isinstance(other, (Block, dict)):
+            return self.to_dict() == (other.to_dict() if isinstance(other, Block) else other)
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+def to_compact(block):
+    return block if isinstance(block, Block) else Block.from_dict(block)
+
+
+def to_dict(block):
+    return block.to_dict() if isinstance(block, Block) else block
+
+
+# Convert a loaded chain in place, one block at a time, so the dict and
+# compact copies of the whole chain never coexist
+def compact_chain(blockchain):
+    for i, block in enumerate(blockchain):
+        blockchain[i] = to_compact(block)
+    return blockchain
+
+
+def chain_to_dicts(blockchain):
+    return [to_dict(block) for block in blockchain]
+
+
+# Compare the memory held by a JSON chain as dicts and as compact objects
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    json_path = argv[0] if argv else "blockchain_data.json"
+    with open(json_path, 'r') as f:
+        text = f.read()
+
+    tracemalloc.start()
+    blockchain = json.loads(text)
+    dict_bytes = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    compact = [Block.from_dict(block) for block in blockchain]
+    seconds = time.perf_counter() - started
+    del blockchain
+    compact_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    lossless = chain_to_dicts(compact) == json.loads(text)
+    products = sum(len(block.products) for block in compact)
+    print(f"{len(compact)} blocks, {products} products: dicts {dict_bytes / 1024:.0f} KiB, "
+          f"compact {compact_bytes / 1024:.0f} KiB, converted in {seconds:.3f}s, lossless: {lossless}")
+    return 0 if lossless else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
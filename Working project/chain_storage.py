@@ -0,0 +1,244 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+import block_store
+import db_pool
+
+# Chain storage backends
+#
+# Both backends expose the same interface as block_store.BlockLog:
+#   exists(), load(), append(block), append_many(blocks), compact(blockchain),
+#   read_range(start, stop), read_block(index), signature(), len(store) and a
+#   unique `path`
+# so initialize_blockchain, add_block and the block batcher work with either.
+#
+# "log"    - the append-only block log (default)
+# "sqlite" - blocks and products in SQLite (WAL mode, pooled connections) with indexes on
+#            barcode_hash, manufacturer_name and product_name. It lives in
+#            app.db next to the Flask tables so both frontends share one store.
+#
+# The backend is picked with the CHAIN_STORAGE environment variable.
+
+STORAGE_BACKEND = os.environ.get("CHAIN_STORAGE", "log")
+SQLITE_PATH = os.environ.get("CHAIN_DB", "app.db")
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS chain_blocks (
+        chain TEXT NOT NULL,
+        block_index INTEGER NOT NULL,
+        timestamp REAL,
+        previous_hash TEXT,
+        hash TEXT,
+        hash_version INTEGER,
+        PRIMARY KEY (chain, block_index)
+    );
+    CREATE TABLE IF NOT EXISTS chain_products (
+        chain TEXT NOT NULL,
+        block_index INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        product_name TEXT,
+        manufacturer_name TEXT,
+        barcode_hash TEXT,
+        PRIMARY KEY (chain, block_index, position)
+    );
+    CREATE TABLE IF NOT EXISTS chain_meta (
+        chain TEXT PRIMARY KEY,
+        generation INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_chain_products_barcode_hash ON chain_products (barcode_hash, chain);
+    CREATE INDEX IF NOT EXISTS idx_chain_products_manufacturer ON chain_products (chain, manufacturer_name);
+    CREATE INDEX IF NOT EXISTS idx_chain_products_product ON chain_products (chain, product_name);
+'''
+
+# Statements are kept as constants so sqlite3's statement cache reuses the
+# compiled (prepared) form on every call
+INSERT_BLOCK = 'INSERT OR REPLACE INTO chain_blocks VALUES (?, ?, ?, ?, ?, ?)'
+DELETE_BLOCK_PRODUCTS = 'DELETE FROM chain_products WHERE chain = ? AND block_index = ?'
+INSERT_PRODUCT = 'INSERT INTO chain_products VALUES (?, ?, ?, ?, ?, ?)'
+SELECT_BLOCKS = ('SELECT block_index, timestamp, previous_hash, hash, hash_version FROM chain_blocks '
+                 'WHERE chain = ? AND block_index >= ? AND block_index < ? ORDER BY block_index')
+SELECT_PRODUCTS = ('SELECT block_index, product_name, manufacturer_name, barcode_hash FROM chain_products '
+                   'WHERE chain = ? AND block_index >= ? AND block_index < ? ORDER BY block_index, position')
+SELECT_PRODUCT_BY_BARCODE = ('SELECT block_index, position, product_name, manufacturer_name FROM chain_products '
+                             'WHERE chain = ? AND barcode_hash = ? LIMIT 1')
+COUNT_BLOCKS = 'SELECT COUNT(*) FROM chain_blocks WHERE chain = ?'
+HAS_BLOCKS = 'SELECT 1 FROM chain_blocks WHERE chain = ? LIMIT 1'
+INSERT_GENERATION = 'INSERT OR IGNORE INTO chain_meta VALUES (?, 0)'
+BUMP_GENERATION = 'UPDATE chain_meta SET generation = generation + 1 WHERE chain = ?'
+SELECT_GENERATION = 'SELECT generation FROM chain_meta WHERE chain = ?'
+
+
+# Connections come from the shared per-database pool (WAL, tuned pragmas).
+# Reads run concurrently; writes are serialized and committed with
+# synchronous=FULL so a sealed block survives a power loss.
+class SQLiteChainStore:
+    def __init__(self, db_path, chain, pool=None):
+        self.db_path = db_path
+        self.chain = chain
+        self.path = f"{db_path}#{chain}"
+        self.pool = pool or db_pool.get_pool(db_path)
+        self.write_lock = threading.Lock()
+        with self.pool.connection() as conn:
+            conn.executescript(SCHEMA)
+        self.length = self._count()
+
+    def __len__(self):
+        return self.length
+
+    def _count(self):
+        with self.pool.connection() as conn:
+            return conn.execute(COUNT_BLOCKS, (self.chain,)).fetchone()[0]
+
+    # Every write transaction bumps this chain's generation, so writes to
+    # other chains in the same database don't change its signature
+    @contextmanager
+    def _writer(self):
+        with self.write_lock, self.pool.connection() as conn:
+            conn.execute('PRAGMA synchronous=FULL')
+            try:
+                with conn:
+                    yield conn
+                    conn.execute(INSERT_GENERATION, (self.chain,))
+                    conn.execute(BUMP_GENERATION, (self.chain,))
+            finally:
+                conn.execute('PRAGMA synchronous=NORMAL')
+
+    # Asks the database, so blocks written by other processes count
+    def exists(self):
+        with self.pool.connection() as conn:
+            return conn.execute(HAS_BLOCKS, (self.chain,)).fetchone() is not None
+
+    # One primary-key lookup; changes on every write to this chain,
+    # compact() included
+    def signature(self):
+        with self.pool.connection() as conn:
+            row = conn.execute(SELECT_GENERATION, (self.chain,)).fetchone()
+        return (row[0] if row else 0,)
+
+    def _write(self, cursor, block):
+        cursor.execute(INSERT_BLOCK, (self.chain, block["index"], block["timestamp"], block["previous_hash"],
+                                      block["hash"], block.get("hash_version")))
+        cursor.execute(DELETE_BLOCK_PRODUCTS, (self.chain, block["index"]))
+        cursor.executemany(INSERT_PRODUCT, [
+            (self.chain, block["index"], position, product["product"]["product_name"],
+             product["product"]["manufacturer_name"], product.get("barcode_hash"))
+            for position, product in enumerate(block["product_details"])
+        ])
+
+    def append(self, block):
+        self.append_many([block])
+
+    # All blocks go in one transaction, i.e. one durable commit
+    def append_many(self, blocks):
+        if not blocks:
+            return
+        with self._writer() as conn:
+            cursor = conn.cursor()
+            for block in blocks:
+                self._write(cursor, block)
+        self.length = max(self.length, max(block["index"] for block in blocks) + 1)
+
+    def compact(self, blockchain):
+        with self._writer() as conn:
+            conn.execute('DELETE FROM chain_blocks WHERE chain = ?', (self.chain,))
+            conn.execute('DELETE FROM chain_products WHERE chain = ?', (self.chain,))
+            cursor = conn.cursor()
+            for block in blockchain:
+                self._write(cursor, block)
+        self.length = len(blockchain)
+
+    # Rebuild blocks in the same dict layout the JSON chain uses
+    def read_range(self, start, stop=None):
+        stop = self.length if stop is None else stop
+        with self.pool.connection() as conn:
+            block_rows = conn.execute(SELECT_BLOCKS, (self.chain, start, stop)).fetchall()
+            product_rows = conn.execute(SELECT_PRODUCTS, (self.chain, start, stop)).fetchall()
+
+        blocks = []
+        by_index = {}
+        for block_index, timestamp, previous_hash, block_hash, hash_version in block_rows:
+            block = {"index": block_index, "timestamp": timestamp, "product_details": [], "previous_hash": previous_hash}
+            if hash_version is not None:
+                block["hash_version"] = hash_version
+            block["hash"] = block_hash
+            blocks.append(block)
+            by_index[block_index] = block
+        for block_index, product_name, manufacturer_name, barcode_hash in product_rows:
+            product = {"product": {"product_name": product_name, "manufacturer_name": manufacturer_name}}
+            if barcode_hash is not None:
+                product["barcode_hash"] = barcode_hash
+            by_index[block_index]["product_details"].append(product)
+        return blocks
+
+    def read_block(self, index):
+        blocks = self.read_range(index, index + 1)
+        return blocks[0] if blocks else None
+
+    def load(self):
+        self.length = self._count()
+        return self.read_range(0, self.length)
+
+    # Indexed lookups straight against the database
+    def find_product(self, barcode_hash):
+        with self.pool.connection() as conn:
+            row = conn.execute(SELECT_PRODUCT_BY_BARCODE, (self.chain, barcode_hash)).fetchone()
+        if row is None:
+            return None
+        return {"block_index": row[0], "position": row[1], "product_name": row[2], "manufacturer_name": row[3]}
+
+    def contains_barcode(self, barcode_hash):
+        return self.find_product(barcode_hash) is not None
+
+
+# Look barcode hashes up across every chain stored in a database, with one
+# IN query (the Flask app uses this to verify products registered through
+# the Streamlit dashboards)
+def lookup_products(conn, barcode_hashes):
+    if not barcode_hashes:
+        return {}
+    placeholders = ','.join('?' * len(barcode_hashes))
+    rows = conn.execute(f'SELECT barcode_hash, product_name, manufacturer_name FROM chain_products '
+                        f'WHERE barcode_hash IN ({placeholders})', list(barcode_hashes)).fetchall()
+    return {row[0]: {"product_name": row[1], "manufacturer_name": row[2]} for row in rows}
+
+
+def chain_name_for(json_path):
+    return os.path.splitext(os.path.basename(json_path))[0]
+
+
+# Open the configured store for a chain
+def open_storage(json_path, backend=None):
+    backend = backend or STORAGE_BACKEND
+    if backend == "sqlite":
+        return SQLiteChainStore(SQLITE_PATH, chain_name_for(json_path))
+    return block_store.BlockLog(block_store.log_path_for(json_path))
+
+
+# One-shot copy of a legacy blockchain.json / blockchain_data.json into a store
+def migrate_json_chain(json_path, store):
+    with open(json_path, 'r') as f:
+        store.compact(json.load(f))
+
+
+# Open a store and load its chain, migrating the legacy JSON file the first time
+def open_chain(json_path, backend=None):
+    store = open_storage(json_path, backend)
+    if not store.exists() and os.path.exists(json_path):
+        migrate_json_chain(json_path, store)
+    return store, store.load()
+
+
+# Read a chain without migrating anything
+def read_chain(json_path, backend=None):
+    backend = backend or STORAGE_BACKEND
+    if backend == "sqlite":
+        store = SQLiteChainStore(SQLITE_PATH, chain_name_for(json_path))
+        if store.exists():
+            return store.load()
+        if os.path.exists(json_path):
+            with open(json_path, 'r') as f:
+                return json.load(f)
+        return []
+    return block_store.read_chain(json_path)
@@ -0,0 +1,135 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import block_hashing
+import chain_storage
+
+# Full-chain integrity verification
+#
+# Every block's hash is recomputed (in chunks spread over a process pool) and
+# every previous_hash is checked against the hash of the block before it.
+# A checkpoint file lets later runs only verify the blocks added since.
+
+CHUNK_SIZE = 2000
+# Chains shorter than this are verified in-process, a pool would only add overhead
+PARALLEL_THRESHOLD = 5000
+
+# Placeholder hash of the original genesis blocks, which was never computed
+GENESIS_HASH = "genesis_block"
+
+
+def _block_hash_ok(block):
+    if block["hash"] == GENESIS_HASH and block["index"] == 0:
+        return True
+    return block_hashing.verify_block_hash(block)
+
+
+# Runs in the worker processes: returns the first block in the chunk whose
+# stored hash does not match its contents, or None
+def _verify_chunk(blocks):
+    for block in blocks:
+        if not _block_hash_ok(block):
+            return block["index"]
+    return None
+
+
+def _first_broken_link(blockchain, start):
+    for i in range(max(start, 1), len(blockchain)):
+        if blockchain[i]["previous_hash"] != blockchain[i - 1]["hash"]:
+            return i
+    return None
+
+
+def _first_broken_hash(blockchain, start, workers, chunk_size):
+    blocks = blockchain[start:]
+    if workers == 1 or len(blocks) < PARALLEL_THRESHOLD:
+        return _verify_chunk(blocks)
+    chunks = [blocks[i:i + chunk_size] for i in range(0, len(blocks), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # map keeps chunk order, so the first hit is the first broken block
+        for broken in executor.map(_verify_chunk, chunks):
+            if broken is not None:
+                return broken
+    return None
+
+
+def load_checkpoint(checkpoint_path, blockchain):
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return 0
+    try:
+        with open(checkpoint_path, 'r') as f:
+            checkpoint = json.load(f)
+        length = checkpoint["verified_length"]
+        tip_hash = checkpoint["tip_hash"]
+    except (OSError, ValueError, KeyError):
+        return 0
+    # Only trust the checkpoint if the block it ended on is unchanged
+    if 0 < length <= len(blockchain) and blockchain[length - 1]["hash"] == tip_hash:
+        return length
+    return 0
+
+
+def save_checkpoint(checkpoint_path, blockchain):
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({"verified_length": len(blockchain), "tip_hash": blockchain[-1]["hash"]}, f)
+    os.replace(tmp_path, checkpoint_path)
+
+
+# Verify hashes and links of the chain. Returns a result dict with
+# "valid", "first_broken", "reason", "blocks_checked", "seconds" and "blocks_per_sec".
+def verify_chain(blockchain, workers=None, chunk_size=CHUNK_SIZE, checkpoint_path=None):
+    started = time.perf_counter()
+    start = load_checkpoint(checkpoint_path, blockchain)
+
+    broken_hash = _first_broken_hash(blockchain, start, workers, chunk_size)
+    broken_link = _first_broken_link(blockchain, start)
+
+    first_broken, reason = None, None
+    candidates = [(broken_hash, "hash mismatch"), (broken_link, "previous_hash does not match previous block")]
+    for index, message in candidates:
+        if index is not None and (first_broken is None or index < first_broken):
+            first_broken, reason = index, message
+
+    seconds = time.perf_counter() - started
+    blocks_checked = len(blockchain) - start
+    valid = first_broken is None
+    if valid and checkpoint_path and blockchain:
+        save_checkpoint(checkpoint_path, blockchain)
+    return {
+        "valid": valid,
+        "first_broken": first_broken,
+        "reason": reason,
+        "blocks_checked": blocks_checked,
+        "resumed_from": start,
+        "seconds": seconds,
+        "blocks_per_sec": blocks_checked / seconds if seconds > 0 else float("inf"),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verify the hashes and links of a blockchain file.")
+    parser.add_argument("chain", help="blockchain JSON file (its configured store is used when present)")
+    parser.add_argument("--workers", type=int, default=None, help="number of hashing processes")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="blocks per worker task")
+    parser.add_argument("--checkpoint", help="checkpoint file for incremental re-verification")
+    args = parser.parse_args(argv)
+
+    blockchain = chain_storage.read_chain(args.chain)
+    result = verify_chain(blockchain, args.workers, args.chunk_size, args.checkpoint)
+
+    print(f"Checked {result['blocks_checked']} blocks (resumed from {result['resumed_from']}) "
+          f"in {result['seconds']:.3f}s ({result['blocks_per_sec']:.0f} blocks/sec)")
+    if result["valid"]:
+        print("Chain is valid.")
+        return 0
+    print(f"Chain is broken at block {result['first_broken']}: {result['reason']}")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
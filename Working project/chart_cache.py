@@ -0,0 +1,56 @@
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import matplotlib.pyplot as plt
+
+# Rendered chart cache
+#
+# show_analytics re-created its matplotlib figures on every page view (and
+# never closed them). Charts are now rendered to PNG once per version of the
+# analytics aggregates and served from this process-wide cache until the
+# aggregates change; older renders are evicted least recently used first.
+
+MAX_ENTRIES = 64
+DPI = 100
+
+
+class ChartCache:
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.renders = 0
+
+    # `render()` is only called when nothing is cached for (name, version)
+    def get(self, name, version, render):
+        key = (name, version)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+        value = render()
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            self.renders += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value
+
+
+# PNG bytes of a figure; the figure is closed so pyplot doesn't keep it alive
+def figure_png(fig, dpi=DPI):
+    buffer = BytesIO()
+    fig.savefig(buffer, format="png", dpi=dpi, bbox_inches="tight")
+    plt.close(fig)
+    return buffer.getvalue()
+
+
+_cache = ChartCache()
+
+
+def get_chart(name, version, render):
+    return _cache.get(name, version, render)
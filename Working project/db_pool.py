@@ -0,0 +1,141 @@
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# SQLite connection pool
+#
+# Opening and closing a connection on every request costs a file open,
+# schema parsing and lock churn. The pool keeps up to `size` connections
+# open, configured once with WAL and tuned pragmas, and hands them out to
+# one thread at a time. get_pool() returns one shared pool per database
+# file so the Flask app and the chain store reuse the same connections.
+
+DEFAULT_POOL_SIZE = 8
+DEFAULT_TIMEOUT = 5.0
+
+PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-16000",  # 16 MB page cache per connection
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+]
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, db_path, size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, pragmas=PRAGMAS):
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = pragmas
+        self.idle = queue.LifoQueue()  # most recently used first, its pages are warm
+        self.lock = threading.Lock()
+        self.created = 0
+        self.acquired = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.timeouts = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=self.timeout)
+        for pragma in self.pragmas:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self.lock:
+                if self.created < self.size:
+                    self.created += 1
+                    create = True
+                else:
+                    create = False
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self.lock:
+                        self.created -= 1
+                    raise
+            else:
+                started = time.perf_counter()
+                try:
+                    conn = self.idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self.lock:
+                        self.timeouts += 1
+                    raise PoolTimeout(f"No connection to {self.db_path} free within {self.timeout}s")
+                with self.lock:
+                    self.waits += 1
+                    self.wait_seconds += time.perf_counter() - started
+        with self.lock:
+            self.acquired += 1
+        return conn
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self.idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def metrics(self):
+        with self.lock:
+            idle = self.idle.qsize()
+            return {
+                "db_path": self.db_path,
+                "size": self.size,
+                "created": self.created,
+                "idle": idle,
+                "in_use": self.created - idle,
+                "acquired": self.acquired,
+                "waits": self.waits,
+                "wait_seconds": round(self.wait_seconds, 6),
+                "timeouts": self.timeouts,
+            }
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self.lock:
+                self.created -= 1
+
+
+_pools = {}
+_registry_lock = threading.Lock()
+
+
+# One pool per database file for the whole process. `size` only applies
+# when the pool is first created.
+def get_pool(db_path, size=DEFAULT_POOL_SIZE):
+    with _registry_lock:
+        pool = _pools.get(db_path)
+        if pool is None:
+            pool = _pools[db_path] = ConnectionPool(db_path, size)
+        return pool
+
+
+def all_metrics():
+    with _registry_lock:
+        pools = list(_pools.values())
+    return [pool.metrics() for pool in pools]
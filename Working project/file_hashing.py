@@ -0,0 +1,61 @@
+import hashlib
+
+# Streaming SHA-256 of uploaded barcode files
+#
+# Uploads are hashed chunk by chunk (or straight from the in-memory buffer
+# of a Streamlit UploadedFile) instead of reading the whole file into a new
+# bytes object first.
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def _hash_chunks(read_into, hasher, chunk_size, sink=None):
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    while True:
+        size = read_into(buffer)
+        if not size:
+            break
+        hasher.update(view[:size])
+        if sink is not None:
+            sink.write(view[:size])
+    return hasher
+
+
+def _read_into(file):
+    if hasattr(file, "readinto"):
+        return file.readinto
+
+    def read_into(buffer):
+        data = file.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+    return read_into
+
+
+# Hash an open binary file object from the start.
+# Streamlit's UploadedFile is a BytesIO, so its buffer is hashed in place.
+def hash_file(file, chunk_size=CHUNK_SIZE):
+    hasher = hashlib.sha256()
+    if hasattr(file, "getbuffer"):
+        with file.getbuffer() as view:
+            hasher.update(view)
+        return hasher.hexdigest()
+    file.seek(0)  # Ensure the file pointer is at the beginning
+    return _hash_chunks(_read_into(file), hasher, chunk_size).hexdigest()
+
+
+def hash_path(file_path, chunk_size=CHUNK_SIZE):
+    with open(file_path, 'rb') as f:
+        return _hash_chunks(f.readinto, hashlib.sha256(), chunk_size).hexdigest()
+
+
+# Hash an upload stream while (optionally) copying it to disk in the same
+# pass. With save_path=None nothing is written at all.
+def hash_upload(stream, save_path=None, chunk_size=CHUNK_SIZE):
+    hasher = hashlib.sha256()
+    if save_path is None:
+        return _hash_chunks(_read_into(stream), hasher, chunk_size).hexdigest()
+    with open(save_path, 'wb') as f:
+        _hash_chunks(_read_into(stream), hasher, chunk_size, sink=f)
+    return hasher.hexdigest()
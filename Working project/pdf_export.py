@@ -0,0 +1,353 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import chain_storage
+
+# Streaming PDF export of the chain
+#
+# generate_blockchain_pdf used to draw every line with its own reportlab
+# drawString call and keep the whole document in a BytesIO until save(). This
+# module writes the same layout (letter pages, Helvetica 12, name /
+# manufacturer / barcode lines) as a plain PDF 1.4 file one page at a time:
+# each finished page is one compressed text object that is written out
+# immediately, so memory stays at a single page no matter how long the chain
+# is and the first bytes are available right away. Only the byte offsets of
+# the objects are kept for the cross-reference table at the end.
+#
+# Text uses the standard Helvetica font with WinAnsiEncoding (cp1252), so no
+# font file is embedded. Characters outside cp1252 (Cyrillic, Greek, CJK, ...)
+# are printed as "?"; names in those scripts need an embedded TrueType font.
+#
+# Exports can be limited to one manufacturer and/or a block range, and
+# export_in_background() runs them in a worker thread so the dashboard stays
+# responsive. The CLI reports time and peak memory per 10k products.
+#
+# Exported files are cached. A small state file next to each PDF records the
+# hash of the last exported block and where the last page starts. If that
+# block is unchanged the PDF is served as is; if blocks were appended after
+# it, the finished pages are copied over byte for byte and only the last page
+# onwards is rendered again.
+
+PAGE_WIDTH = 612.0   # letter, in points
+PAGE_HEIGHT = 792.0
+MARGIN = 50
+FONT_SIZE = 12
+TITLE = "Blockchain Data"
+EXPORT_DIR = "exports"
+EXPORT_WORKERS = 2
+STATE_SUFFIX = ".state.json"
+
+CATALOG_ID = 1
+PAGES_ID = 2
+FONT_ID = 3
+FIRST_PAGE_ID = 4
+
+
+# Characters cp1252 can't encode become "?" (see the note at the top)
+def _escape(text):
+    text = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    return text.encode("cp1252", errors="replace")
+
+
+def _range_stop(blockchain, stop):
+    return len(blockchain) if stop is None else min(stop, len(blockchain))
+
+
+# Products of the selected blocks in chain order, as (block index, position
+# in the block, product). `position` skips products of the first block.
+def iter_products(blockchain, manufacturer=None, start=0, stop=None, position=0):
+    start = max(start, 0)
+    for index in range(start, _range_stop(blockchain, stop)):
+        product_details = blockchain[index]["product_details"]
+        for product_position in range(position if index == start else 0, len(product_details)):
+            product = product_details[product_position]
+            if manufacturer is None or product["product"]["manufacturer_name"] == manufacturer:
+                yield index, product_position, product
+
+
+# Lay products out on pages, matching the positions the reportlab version
+# used. Yields (lines, first, count) per page: the (y, text) lines, the
+# (block index, position) of the page's first product (None if it has none)
+# and its number of products. Without a title the layout continues a
+# document on a fresh page.
+def iter_pages(products, title=TITLE):
+    y = PAGE_HEIGHT - MARGIN
+    lines = []
+    first = None
+    count = 0
+    if title is not None:
+        lines.append((y, title))
+        y -= 20
+    for block_index, position, product in products:
+        if first is None:
+            first = (block_index, position)
+        count += 1
+        lines.append((y, f"Product Name: {product['product']['product_name']}"))
+        y -= 15
+        lines.append((y, f"Manufacturer: {product['product']['manufacturer_name']}"))
+        y -= 15
+        lines.append((y, f"Barcode Hash: {product.get('barcode_hash')}"))
+        y -= 20
+        if y < MARGIN:  # Start a new page if space runs out
+            yield lines, first, count
+            lines = []
+            first = None
+            count = 0
+            y = PAGE_HEIGHT - MARGIN
+    if lines:
+        yield lines, first, count
+
+
+# One BT/ET block per page; Td moves are relative to the previous line
+def page_content(lines):
+    parts = [b"BT /F1 %d Tf" % FONT_SIZE]
+    previous_y = None
+    for y, text in lines:
+        if previous_y is None:
+            parts.append(b"%d %g Td" % (MARGIN, y))
+        else:
+            parts.append(b"0 %g Td" % (y - previous_y))
+        parts.append(b"(" + _escape(text) + b") Tj")
+        previous_y = y
+    parts.append(b"ET")
+    return b"\n".join(parts)
+
+
+class _PDFWriter:
+    def __init__(self, position=0, offsets=None):
+        self.position = position
+        self.offsets = dict(offsets or {})
+
+    def chunk(self, data):
+        self.position += len(data)
+        return data
+
+    def obj(self, obj_id, body):
+        self.offsets[obj_id] = self.position
+        return self.chunk(b"%d 0 obj\n" % obj_id + body + b"\nendobj\n")
+
+    def stream(self, obj_id, data):
+        data = zlib.compress(data)
+        return self.obj(obj_id, b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(data) + data + b"\nendstream")
+
+
+# Yield the PDF as byte chunks, one per page plus header and trailer. The
+# chunks can be written to a file or streamed as an HTTP response. `stats`,
+# when given, is filled with the product and page counts and a `resume`
+# point: where the last page starts, so a later export can continue there.
+# Passing such a point as `resume` continues that document instead of
+# starting a new one; `products` must then start at resume["block"] /
+# resume["position"], and the bytes before resume["offset"] are not yielded.
+def iter_pdf(products, title=TITLE, stats=None, resume=None):
+    if resume is None:
+        writer = _PDFWriter()
+        page_count = 0
+        product_count = 0
+        yield writer.chunk(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        yield writer.obj(CATALOG_ID, b"<< /Type /Catalog /Pages %d 0 R >>" % PAGES_ID)
+        yield writer.obj(FONT_ID, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+    else:
+        writer = _PDFWriter(resume["offset"], {int(obj_id): offset for obj_id, offset in resume["offsets"].items()})
+        page_count = resume["pages"]
+        product_count = resume["products"]
+        title = None
+
+    last_page = None
+    for lines, first, count in iter_pages(products, title):
+        # The title page is never a resume point, it can't be rebuilt without the title
+        if first is not None and page_count > 0:
+            last_page = {"offset": writer.position, "pages": page_count, "products": product_count,
+                         "offsets": {obj_id: offset for obj_id, offset in writer.offsets.items() if obj_id != PAGES_ID},
+                         "block": first[0], "position": first[1]}
+        else:
+            last_page = None
+        page_id = FIRST_PAGE_ID + 2 * page_count
+        page_count += 1
+        product_count += count
+        yield writer.stream(page_id + 1, page_content(lines)) + writer.obj(page_id, (
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %g %g] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>"
+            % (PAGES_ID, PAGE_WIDTH, PAGE_HEIGHT, FONT_ID, page_id + 1)))
+
+    page_ids = range(FIRST_PAGE_ID, FIRST_PAGE_ID + 2 * page_count, 2)
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    yield writer.obj(PAGES_ID, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, page_count))
+
+    size = FIRST_PAGE_ID + 2 * page_count
+    xref_position = writer.position
+    xref = [b"xref\n0 %d\n" % size, b"0000000000 65535 f \n"]
+    xref.extend(b"%010d 00000 n \n" % writer.offsets[obj_id] for obj_id in range(1, size))
+    xref.append(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, CATALOG_ID, xref_position))
+    yield writer.chunk(b"".join(xref))
+
+    if stats is not None:
+        stats["products"] = product_count
+        stats["pages"] = page_count
+        stats["bytes"] = writer.position
+        stats["resume"] = last_page
+
+
+# Write the (filtered) chain to a file object and return timing stats
+def write_blockchain_pdf(blockchain, out, manufacturer=None, start=0, stop=None):
+    started = time.perf_counter()
+    stats = {}
+    for chunk in iter_pdf(iter_products(blockchain, manufacturer, start, stop), stats=stats):
+        out.write(chunk)
+    del stats["resume"]
+    stats["seconds"] = time.perf_counter() - started
+    stats["seconds_per_10k"] = stats["seconds"] * 10000 / stats["products"] if stats["products"] else 0.0
+    return stats
+
+
+def state_path_for(path):
+    return path + STATE_SUFFIX
+
+
+def load_state(path):
+    try:
+        with open(state_path_for(path), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_state(path, state):
+    tmp_path = f"{state_path_for(path)}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_path_for(path))
+
+
+def _copy_prefix(source, target, length):
+    while length > 0:
+        chunk = source.read(min(length, 1024 * 1024))
+        if not chunk:
+            raise ValueError("The cached PDF export is shorter than its state file says")
+        target.write(chunk)
+        length -= len(chunk)
+
+
+_path_locks = {}
+_path_locks_lock = threading.Lock()
+
+
+# One export per file at a time; a second request for it waits and then
+# finds the cached result
+def _lock_for(path):
+    with _path_locks_lock:
+        return _path_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+# Write to `path` through a temp file so a half-written export is never
+# served, reusing the cached export at `path` where it is still valid.
+# stats["cache"] tells which happened: "hit", "incremental" or "full".
+def export_to_file(blockchain, path, manufacturer=None, start=0, stop=None):
+    started = time.perf_counter()
+    stop = _range_stop(blockchain, stop)
+    tip_hash = blockchain[stop - 1]["hash"] if stop > start else None
+    filters = {"manufacturer": manufacturer, "start": start}
+
+    with _lock_for(path):
+        state = load_state(path)
+        if state is not None and (state.get("filters") != filters or not os.path.exists(path)):
+            state = None
+
+        if state is not None and state["stop"] == stop and state["tip_hash"] == tip_hash:
+            # Nothing changed in the exported range
+            stats = dict(state["stats"], cache="hit", pages_rendered=0, path=path)
+            stats["seconds"] = time.perf_counter() - started
+            stats["seconds_per_10k"] = 0.0
+            return stats
+
+        resume = None
+        if (state is not None and state["resume"] is not None and start < state["stop"] <= stop
+                and blockchain[state["stop"] - 1]["hash"] == state["tip_hash"]):
+            # Blocks were only appended: keep the finished pages
+            resume = state["resume"]
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        stats = {}
+        with open(tmp_path, 'wb') as f:
+            if resume is None:
+                products = iter_products(blockchain, manufacturer, start, stop)
+            else:
+                with open(path, 'rb') as cached:
+                    _copy_prefix(cached, f, resume["offset"])
+                products = iter_products(blockchain, manufacturer, resume["block"], stop, resume["position"])
+            for chunk in iter_pdf(products, stats=stats, resume=resume):
+                f.write(chunk)
+        os.replace(tmp_path, path)
+
+        save_state(path, {"filters": filters, "stop": stop, "tip_hash": tip_hash, "resume": stats.pop("resume"),
+                          "stats": dict(stats)})
+        stats["cache"] = "full" if resume is None else "incremental"
+        stats["pages_rendered"] = stats["pages"] - (0 if resume is None else resume["pages"])
+        stats["seconds"] = time.perf_counter() - started
+        stats["seconds_per_10k"] = stats["seconds"] * 10000 / stats["products"] if stats["products"] else 0.0
+        stats["path"] = path
+        return stats
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="pdf-export")
+        return _executor
+
+
+# One cached file per chain and filter combination
+def export_path(manufacturer=None, start=0, stop=None, directory=EXPORT_DIR, chain=None):
+    name = chain_storage.chain_name_for(chain) if chain else "blockchain_data"
+    if manufacturer:
+        name += "_" + "".join(ch if ch.isalnum() else "_" for ch in manufacturer)
+    if start or stop is not None:
+        name += f"_{start}-{'' if stop is None else stop}"
+    return os.path.join(directory, name + ".pdf")
+
+
+# Export in a worker thread and return a Future for the stats dict. The
+# block range is fixed when the job is queued, so blocks added meanwhile
+# are not half-included. Exports up to the tip share one cached file.
+def export_in_background(blockchain, path=None, manufacturer=None, start=0, stop=None, chain=None):
+    path = path or export_path(manufacturer, start, stop, chain=chain)
+    stop = _range_stop(blockchain, stop)
+    return _get_executor().submit(export_to_file, blockchain, path, manufacturer, start, stop)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the blockchain to a PDF, one page at a time.")
+    parser.add_argument("output", help="PDF file to write (an export already there is reused where possible)")
+    parser.add_argument("--chain", default="blockchain_data.json", help="blockchain JSON file (its configured store is used when present)")
+    parser.add_argument("--manufacturer", default=None, help="only export this manufacturer's products")
+    parser.add_argument("--start", type=int, default=0, help="first block index")
+    parser.add_argument("--stop", type=int, default=None, help="block index to stop before")
+    args = parser.parse_args(argv)
+
+    blockchain = chain_storage.read_chain(args.chain)
+    tracemalloc.start()
+    stats = export_to_file(blockchain, args.output, args.manufacturer, args.start, args.stop)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{stats['products']} products on {stats['pages']} pages ({stats['bytes']} bytes, {stats['cache']}, "
+          f"{stats['pages_rendered']} pages rendered) in {stats['seconds']:.3f}s: "
+          f"{stats['seconds_per_10k']:.3f}s per 10k products, peak export memory {peak / 1024:.0f} KiB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
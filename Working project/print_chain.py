@@ -1,9 +1,16 @@
 import hashlib
 import datetime
+import html
+import os
+import sys
 import streamlit as st
+import chain_cache
+import chain_explorer
 
 # Block and Blockchain Classes
 class Block:
+    __slots__ = ("index", "timestamp", "data", "previous_hash", "hash")
+
     def __init__(self, index, timestamp, data, previous_hash):
         self.index = index
         self.timestamp = timestamp
@@ -33,6 +40,13 @@ class Blockchain:
     def get_blocks(self):
         return self.chain
 
+    # Same read interface as the chain stores, so the explorer can page it
+    def __len__(self):
+        return len(self.chain)
+
+    def read_range(self, start, stop=None):
+        return self.chain[start:stop]
+
 # Streamlit App
 def display_blockchain(blockchain):
     st.title("📦 Blockchain Viewer with Boxes and Lines")
@@ -58,28 +72,68 @@ def display_blockchain(blockchain):
         </style>
     """, unsafe_allow_html=True)
 
+    # Filters and paging run server-side; only one page of blocks is read and rendered
+    if hasattr(blockchain, "path"):
+        explorer = chain_explorer.get_explorer(blockchain)  # kept across reruns
+    else:
+        explorer = chain_explorer.ChainExplorer(blockchain)
+    col1, col2, col3 = st.columns(3)
+    block_filter = col1.text_input("Block Index")
+    hash_prefix = col2.text_input("Hash Prefix").strip()
+    manufacturer = col3.text_input("Manufacturer").strip()
+    col1, col2 = st.columns(2)
+    page_size = col1.selectbox("Blocks per Page", [10, 20, 50, 100], index=1)
+    page_number = col2.number_input("Page", min_value=1, value=1, step=1)
+
+    block_index = int(block_filter) if block_filter.strip().isdigit() else None
+    result = explorer.page(int(page_number) - 1, page_size, block_index, hash_prefix or None, manufacturer or None)
+    st.caption(f"{result['total']} matching blocks, page {result['page'] + 1} of {result['pages']}")
+
     # Render blocks and lines
-    for i, block in enumerate(blockchain.get_blocks()):
+    blocks = result["blocks"]
+    parts = []
+    for i, block in enumerate(blocks):
         # Display block
-        st.markdown(f"""
+        # Names come from user input: escape every field rendered as HTML
+        parts.append(f"""
             <div class="block">
-                <h4>Block Index: {block.index}</h4>
-                <p><strong>Timestamp:</strong> {block.timestamp}</p>
-                <p><strong>Data:</strong> {block.data}</p>
-                <p><strong>Previous Hash:</strong> {block.previous_hash}</p>
-                <p><strong>Hash:</strong> {block.hash}</p>
+                <h4>Block Index: {_escape(chain_explorer.block_value(block, "index"))}</h4>
+                <p><strong>Timestamp:</strong> {_escape(chain_explorer.block_value(block, "timestamp"))}</p>
+                <p><strong>Data:</strong> {_escape(block_data(block))}</p>
+                <p><strong>Previous Hash:</strong> {_escape(chain_explorer.block_value(block, "previous_hash"))}</p>
+                <p><strong>Hash:</strong> {_escape(chain_explorer.block_value(block, "hash"))}</p>
             </div>
-        """, unsafe_allow_html=True)
+        """)
 
         # Add a connecting line (except after the last block)
-        if i < len(blockchain.get_blocks()) - 1:
-            st.markdown('<div class="line"></div>', unsafe_allow_html=True)
+        if i < len(blocks) - 1:
+            parts.append('<div class="line"></div>')
+    # One markdown element for the whole page instead of one per block
+    st.markdown("".join(parts), unsafe_allow_html=True)
+
+
+def _escape(value):
+    return html.escape(str(value))
+
+# Stored blocks carry products; the demo blocks carry a data string
+def block_data(block):
+    if isinstance(block, dict):
+        return ", ".join(f"{product['product']['product_name']} ({product['product']['manufacturer_name']})"
+                         for product in block["product_details"])
+    return block.data
 
 # Main
 if __name__ == "__main__":
-    blockchain = Blockchain()
-    blockchain.add_block("First Block")
-    blockchain.add_block("Second Block")
-    blockchain.add_block("Third Block")
+    # `streamlit run print_chain.py -- blockchain.json` browses a stored chain,
+    # loaded once per process
+    if len(sys.argv) > 1 and os.path.exists(sys.argv[1]):
+        shared_chain = chain_cache.get_shared_chain(sys.argv[1])
+        shared_chain.refresh()
+        blockchain = shared_chain.store
+    else:
+        blockchain = Blockchain()
+        blockchain.add_block("First Block")
+        blockchain.add_block("Second Block")
+        blockchain.add_block("Third Block")
     
     display_blockchain(blockchain)
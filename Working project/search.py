@@ -1,10 +1,11 @@
 import streamlit as st
 import hashlib
-import time
 import json
-import os
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
+import file_hashing
+import pdf_export
+import chain_cache
+import chart_cache
+import chain_index
 from io import BytesIO
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -16,97 +17,51 @@ USERS_FILE = "users.json"
 # Set page configuration as the first Streamlit command
 st.set_page_config(page_title="Login System", layout="wide")
 
-# Blockchain setup
+# Blockchain setup: one chain per process, shared by every session and rerun
+shared_chain = chain_cache.get_shared_chain(BLOCKCHAIN_FILE)
+# Block log or SQLite, picked with the CHAIN_STORAGE environment variable
+chain_store = shared_chain.store
 blockchain = []
+barcode_index = None
+search_index = None
 
 # Initialize the blockchain with a genesis block
 def initialize_blockchain():
-    global blockchain
-    if not blockchain:
-        if os.path.exists(BLOCKCHAIN_FILE):
-            # Load blockchain data from file if it exists
-            with open(BLOCKCHAIN_FILE, 'r') as f:
-                blockchain = json.load(f)
-        else:
-            # Create a genesis block if no file exists
-            genesis_block = {
-                "index": 0,
-                "timestamp": time.time(),
-                "product_details": [],
-                "previous_hash": "0",
-                "hash": "genesis_block"
-            }
-            blockchain.append(genesis_block)
+    global blockchain, barcode_index, search_index
+    # Reuses the cached chain and indexes; reloads only if the store changed on disk
+    shared_chain.refresh()
+    blockchain = shared_chain.blockchain
+    barcode_index = shared_chain.barcode_index
+    search_index = shared_chain.get_search_index()
 
 # Hashing utility functions
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
+# Streams the upload into SHA-256 without copying it
 def hash_file(file):
-    file.seek(0)  # Ensure the file pointer is at the beginning
-    return hashlib.sha256(file.read()).hexdigest()
-
-def hash_block(block):
-    block_string = f"{block['index']}{block['timestamp']}{block['product_details']}{block['previous_hash']}"
-    return hashlib.sha256(block_string.encode()).hexdigest()
+    return file_hashing.hash_file(file)
 
 # Blockchain management
 def add_block(product_details, barcode_hash):
     global blockchain
-    previous_block = blockchain[-1]
-    block = {
-        "index": len(blockchain),
-        "timestamp": time.time(),
-        "product_details": [{"product": product_details, "barcode_hash": barcode_hash}],
-        "previous_hash": previous_block["hash"],
-        "hash": "temporary_placeholder"
-    }
-    block["hash"] = hash_block(block)
-    blockchain.append(block)
-    
-    # Save blockchain to a file after adding a new block
-    with open(BLOCKCHAIN_FILE, 'w') as f:
-        json.dump(blockchain, f)
+    # Checked, written and indexed under the chain's write lock (shared by
+    # every session and process), so a barcode is added only once
+    block = shared_chain.add_product(product_details, barcode_hash)
+    blockchain = shared_chain.blockchain
+    return block is not None
 
 def verify_barcode_in_blockchain(barcode_hash):
-    for block in blockchain:
-        for product in block["product_details"]:
-            if product["barcode_hash"] == barcode_hash:
-                return True
-    return False
+    # The Bloom filter rules out unregistered barcodes before the index is consulted
+    return shared_chain.contains_barcode(barcode_hash)
 
 # PDF Generation
 def generate_blockchain_pdf(blockchain_data):
-    buffer = BytesIO()
-    c = canvas.Canvas(buffer, pagesize=letter)
-    width, height = letter
-    c.setFont("Helvetica", 12)
-    
-    y = height - 50  # Start near the top of the page
-    c.drawString(50, y, "Blockchain Data")
-    y -= 20
-
-    for block in blockchain_data:
-        for product in block['product_details']:
-            product_name = product['product']['product_name']
-            manufacturer_name = product['product']['manufacturer_name']
-            barcode_hash = product['barcode_hash']
-
-            # Display product details in PDF
-            c.drawString(50, y, f"Product Name: {product_name}")
-            y -= 15
-            c.drawString(50, y, f"Manufacturer: {manufacturer_name}")
-            y -= 15
-            c.drawString(50, y, f"Barcode Hash: {barcode_hash}")
-            y -= 20
-
-            if y < 50:  # Start a new page if space runs out
-                c.showPage()
-                y = height - 50
-
-    c.save()
-    buffer.seek(0)
-    return buffer
+    # Served from the export cache: unchanged chains aren't rendered again and
+    # new blocks only add their own pages
+    stats = pdf_export.export_to_file(blockchain_data, pdf_export.export_path(chain=BLOCKCHAIN_FILE))
+    with open(stats["path"], 'rb') as f:
+        return BytesIO(f.read())
 
 # Authentication
 users = {
@@ -153,8 +108,10 @@ def manufacturer_dashboard():
                     "product_name": product_name,
                     "manufacturer_name": manufacturer_name
                 }
-                add_block(product_details, barcode_hash)
-                st.success(f"Product added successfully with Barcode Hash: {barcode_hash}")
+                if add_block(product_details, barcode_hash):
+                    st.success(f"Product added successfully with Barcode Hash: {barcode_hash}")
+                else:
+                    st.error(f"Product with Barcode Hash: {barcode_hash} already exists in the blockchain.")
             else:
                 st.error("Please fill in all the fields and upload a barcode file.")
     
@@ -175,32 +132,17 @@ def user_dashboard():
 
     # Search section for User Dashboard
     search_type = st.radio("Search by", ["Manufacturer Name", "Product Name"])
+    match_type = st.radio("Match", ["Exact", "Case-insensitive", "Prefix"], horizontal=True)
 
     search_term = st.text_input(f"Enter {search_type}")
     if st.button("Search"):
         if search_term:
-            found = False
-            search_results = []
-            for block in blockchain:
-                for product in block["product_details"]:
-                    if search_type == "Manufacturer Name" and product["product"]["manufacturer_name"] == search_term:
-                        search_results.append({
-                            "Product Name": product['product']['product_name'],
-                            "Manufacturer": product['product']['manufacturer_name'],
-                            "Barcode Hash": product['barcode_hash']
-                        })
-                        found = True
-                    elif search_type == "Product Name" and product["product"]["product_name"] == search_term:
-                        search_results.append({
-                            "Product Name": product['product']['product_name'],
-                            "Manufacturer": product['product']['manufacturer_name'],
-                            "Barcode Hash": product['barcode_hash']
-                        })
-                        found = True
+            # Look the term up in the secondary index instead of scanning the chain
+            search_results = search_index.search(search_type, search_term, match_type)
 
-            if found:
+            if search_results:
                 st.write("Search Results:")
-                st.dataframe(pd.DataFrame(search_results))
+                st.dataframe(pd.DataFrame(search_results, columns=chain_index.SEARCH_COLUMNS))
             else:
                 st.error(f"No product found with {search_type}: {search_term}")
         else:
@@ -228,41 +170,42 @@ def user_dashboard():
 # Analytics function
 def show_analytics():
     # Calculate analytics
-    product_count = sum(len(block['product_details']) for block in blockchain)
-    manufacturers = [product['product']['manufacturer_name'] for block in blockchain for product in block['product_details']]
-    unique_barcodes = set(product['barcode_hash'] for block in blockchain for product in block['product_details'])
+    # Running aggregates kept up to date by add_block, nothing is recounted here
+    summary = shared_chain.analytics.summary()
+    product_count = summary["product_count"]
     
-    most_frequent_manufacturer = pd.Series(manufacturers).mode()[0]
+    most_frequent_manufacturer = summary["most_frequent_manufacturer"]
     
     st.subheader("Blockchain Analytics")
     st.write(f"Product Count: {product_count}")
     st.write(f"Most Frequent Manufacturer: {most_frequent_manufacturer}")
-    st.write(f"Unique Barcodes: {len(unique_barcodes)}")
+    st.write(f"Unique Barcodes: {summary['unique_barcodes']}")
     
     # Visualizations
     st.subheader("Analytics Visualization")
     
     # Bar chart for product count per manufacturer
-    manufacturer_counts = pd.Series(manufacturers).value_counts()
+    manufacturer_counts = chart_cache.get_chart("manufacturer_counts", summary["version"],
+        lambda: pd.Series(summary["manufacturer_counts"]).sort_values(ascending=False))
     st.bar_chart(manufacturer_counts)
     
-    # Line chart for product count over time (using timestamp as index)
-    timestamps = [block['timestamp'] for block in blockchain]
-    product_counts_over_time = [len(block['product_details']) for block in blockchain]
-    df = pd.DataFrame({'Timestamp': timestamps, 'Product Count': product_counts_over_time})
-    df = df.sort_values(by='Timestamp')
+    # Line chart for product count over time (products added per time bucket,
+    # bucket width picked so the chart never has more than a few hundred points)
+    df = pd.DataFrame(summary["time_buckets"], columns=['Timestamp', 'Product Count'])
     st.line_chart(df.set_index('Timestamp')['Product Count'])
     
     # Pie chart for distribution of product counts across manufacturers
-    manufacturer_distribution = manufacturer_counts.head(10)  # Top 10 manufacturers
+    manufacturer_distribution = pd.Series(dict(summary["top_manufacturers"]))  # Top 10 manufacturers
     st.write("Top 10 Manufacturers Distribution")
     st.write(manufacturer_distribution)
     
-    # Pie chart for the manufacturer distribution
-    fig, ax = plt.subplots()
-    ax.pie(manufacturer_distribution, labels=manufacturer_distribution.index, autopct='%1.1f%%', startangle=90)
-    ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
-    st.pyplot(fig)
+    # Pie chart for the manufacturer distribution, rendered once per aggregate version
+    def draw_pie():
+        fig, ax = plt.subplots()
+        ax.pie(manufacturer_distribution, labels=manufacturer_distribution.index, autopct='%1.1f%%', startangle=90)
+        ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
+        return chart_cache.figure_png(fig)
+    st.image(chart_cache.get_chart("manufacturer_pie", summary["version"], draw_pie))
 
 # Main Application
 def main():
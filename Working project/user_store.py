@@ -0,0 +1,178 @@
+import json
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: account creation is only serialized within one process
+    fcntl = None
+
+# Cached user store
+#
+# login() used to open and parse users.json on every attempt and
+# create_account() rewrote the whole file. A UserStore keeps the accounts in
+# a dict for O(1) lookups and only re-reads the disk when users.json or its
+# journal changed (size/mtime). A new account is one JSON line appended to
+# the journal (users.log) with a single write + fsync; once the journal holds
+# COMPACT_EVERY entries it is folded back into users.json, written to a temp
+# file and swapped in with os.replace.
+#
+# Creating an account holds a thread lock and, where fcntl exists, an
+# exclusive lock on users.lock, and re-reads any journal lines written by
+# other processes before checking the name, so concurrent sign-ups neither
+# claim the same username nor lose each other's writes.
+
+JOURNAL_SUFFIX = ".log"
+LOCK_SUFFIX = ".lock"
+COMPACT_EVERY = 256
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+
+class UserStore:
+    def __init__(self, path):
+        self.path = path
+        base = os.path.splitext(path)[0]
+        self.journal_path = base + JOURNAL_SUFFIX
+        self.lock_path = base + LOCK_SUFFIX
+        self.lock = threading.RLock()
+        self.users = {}
+        self.snapshot_signature = None
+        self.journal_signature = None
+        self.journal_offset = 0
+        self.journal_entries = 0
+        self.loaded = False
+
+    def _load_snapshot(self):
+        users = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                try:
+                    users = json.load(f)
+                except json.JSONDecodeError as e:
+                    print(f"Error loading JSON: {e}")
+        self.users = users
+        self.snapshot_signature = _stat(self.path)
+        self.journal_offset = 0
+        self.journal_entries = 0
+
+    # Apply journal lines written since the last read. A torn last line (a
+    # writer died mid-append) is left for the next read.
+    def _replay_journal(self):
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'rb') as f:
+                f.seek(self.journal_offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        pass
+                    else:
+                        username = entry.pop("username")
+                        self.users[username] = entry
+                        self.journal_entries += 1
+                    self.journal_offset += len(line)
+        self.journal_signature = _stat(self.journal_path)
+
+    def refresh(self):
+        with self.lock:
+            snapshot_signature = _stat(self.path)
+            journal_signature = _stat(self.journal_path)
+            if self.loaded and snapshot_signature == self.snapshot_signature:
+                if journal_signature == self.journal_signature:
+                    return False
+                if journal_signature is not None and journal_signature[0] >= self.journal_offset:
+                    # Only new sign-ups were appended
+                    self._replay_journal()
+                    return True
+            self._load_snapshot()
+            self._replay_journal()
+            self.loaded = True
+            return True
+
+    def get(self, username):
+        self.refresh()
+        return self.users.get(username)
+
+    def __contains__(self, username):
+        return self.get(username) is not None
+
+    def all(self):
+        self.refresh()
+        return self.users
+
+    def _lock_file(self):
+        lock_file = open(self.lock_path, 'a')
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    # Returns False when the username is already taken
+    def create(self, username, record):
+        with self.lock:
+            lock_file = self._lock_file()
+            try:
+                self.refresh()
+                if username in self.users:
+                    return False
+                line = json.dumps(dict(record, username=username)) + "\n"
+                with open(self.journal_path, 'ab') as f:
+                    f.write(line.encode('utf-8'))
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.users[username] = dict(record)
+                self.journal_offset += len(line.encode('utf-8'))
+                self.journal_entries += 1
+                self.journal_signature = _stat(self.journal_path)
+                if self.journal_entries >= COMPACT_EVERY:
+                    self._compact()
+                return True
+            finally:
+                lock_file.close()
+
+    # Fold the journal into users.json. Replaying a journal entry twice is
+    # harmless, so a crash between the two steps loses nothing.
+    def _compact(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.users, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        open(self.journal_path, 'wb').close()
+        self.snapshot_signature = _stat(self.path)
+        self.journal_signature = _stat(self.journal_path)
+        self.journal_offset = 0
+        self.journal_entries = 0
+
+    def compact(self):
+        with self.lock:
+            lock_file = self._lock_file()
+            try:
+                self.refresh()
+                self._compact()
+            finally:
+                lock_file.close()
+
+
+_stores = {}
+_registry_lock = threading.Lock()
+
+
+# One store per users file for the whole process, so Streamlit reruns and
+# sessions share it
+def get_user_store(path):
+    with _registry_lock:
+        key = os.path.abspath(path)
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = UserStore(path)
+        return store
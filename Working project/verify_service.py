@@ -0,0 +1,212 @@
+import argparse
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+import bulk_verify
+import chain_cache
+import chain_mmap
+import file_hashing
+
+# Asynchronous verification service
+#
+# A small aiohttp server for barcode scanners that need to verify products
+# without going through a Streamlit rerun or the synchronous Flask dev
+# server. The chain and its barcode index are loaded once (through
+# chain_cache, so the same signature-based reload applies) and every request
+# is answered from memory:
+#
+#   GET  /verify/<barcode_hash>   verify a precomputed SHA-256 hash
+#   POST /verify                  verify an uploaded barcode file, sent as the
+#                                 multipart field "barcode" or as the raw body
+#   GET  /health                  chain length and reload generation
+#
+# Uploads are streamed: each chunk is fed to SHA-256 in a thread pool as it
+# arrives, so an upload is never held in memory whole and the event loop
+# keeps accepting connections while large files are hashed. Responses use
+# the bulk_verify statuses: verified, counterfeit or invalid.
+#
+# With --chain-file the service answers from the memory-mapped chain file
+# (chain_mmap) instead of loading the chain, and --processes N starts N
+# worker processes on the same port (SO_REUSEPORT) that all share the one
+# mapped file. Worker 0 rewrites the file when the store changes; every
+# worker maps the new file when it appears.
+
+DEFAULT_CHAIN = "blockchain_data.json"
+DEFAULT_PORT = 8080
+REFRESH_INTERVAL = 5.0
+MAX_UPLOAD_SIZE = 32 * 1024 * 1024
+
+CHAIN_KEY = web.AppKey("shared_chain", chain_cache.SharedChain)
+CHAIN_FILE_KEY = web.AppKey("chain_file", chain_mmap.ChainFile)
+EXECUTOR_KEY = web.AppKey("executor", ThreadPoolExecutor)
+
+logger = logging.getLogger(__name__)
+
+
+def chain_resolver(app):
+    if CHAIN_FILE_KEY in app:
+        return app[CHAIN_FILE_KEY].resolve
+    shared_chain = app[CHAIN_KEY]
+    # One read, so a reload between two attribute reads can't mix chains
+    blockchain, barcode_index = shared_chain.indexed
+    resolve = bulk_verify.chain_resolver(blockchain, barcode_index)
+
+    # Hashes the Bloom filter rules out never reach the index
+    def resolve_registered(hashes):
+        return resolve([barcode_hash for barcode_hash in hashes if shared_chain.might_contain(barcode_hash)])
+    return resolve_registered
+
+
+def verify_hash(resolve, barcode_hash):
+    barcode_hash = barcode_hash.strip().lower()
+    return next(bulk_verify.verify_items([(barcode_hash, barcode_hash)], resolve))
+
+
+async def verify_by_hash(request):
+    result = verify_hash(chain_resolver(request.app), request.match_info["barcode_hash"])
+    return web.json_response(result)
+
+
+# SHA-256 of the chunks returned by `read_chunk()` (b"" at the end); None
+# when the upload is larger than MAX_UPLOAD_SIZE
+async def hash_stream(read_chunk, executor):
+    loop = asyncio.get_running_loop()
+    hasher = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = await read_chunk()
+        if not chunk:
+            return hasher.hexdigest()
+        size += len(chunk)
+        if size > MAX_UPLOAD_SIZE:
+            return None
+        await loop.run_in_executor(executor, hasher.update, chunk)
+
+
+async def verify_upload(request):
+    name = "upload"
+    executor = request.app[EXECUTOR_KEY]
+    if request.content_type.startswith("multipart/"):
+        reader = await request.multipart()
+        while True:
+            part = await reader.next()
+            if part is None:
+                return web.json_response({"error": "missing 'barcode' file field"}, status=400)
+            if part.name == "barcode":
+                name = part.filename or name
+                barcode_hash = await hash_stream(lambda: part.read_chunk(file_hashing.CHUNK_SIZE), executor)
+                break
+    else:
+        barcode_hash = await hash_stream(lambda: request.content.read(file_hashing.CHUNK_SIZE), executor)
+    if barcode_hash is None:
+        return web.json_response({"error": f"upload larger than {MAX_UPLOAD_SIZE} bytes"}, status=413)
+
+    result = verify_hash(chain_resolver(request.app), barcode_hash)
+    result["item"] = name
+    return web.json_response(result)
+
+
+async def health(request):
+    if CHAIN_FILE_KEY in request.app:
+        chain_file = request.app[CHAIN_FILE_KEY]
+        return web.json_response({"blocks": chain_file.block_count, "tip_hash": chain_file.tip_hash})
+    shared_chain = request.app[CHAIN_KEY]
+    return web.json_response({"blocks": len(shared_chain.blockchain), "generation": shared_chain.generation})
+
+
+# Pick up blocks written by the Streamlit apps or the bulk importer. The
+# check is one stat (or query) and a reload runs off the event loop.
+async def refresh_chain(app, interval, refresh):
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await loop.run_in_executor(app[EXECUTOR_KEY], refresh)
+        except Exception:
+            logger.exception("Error refreshing the chain")
+
+
+# `chain_file`: serve from this memory-mapped chain file; `write_chain_file`:
+# this process keeps it in sync with the store
+def create_app(chain=DEFAULT_CHAIN, workers=None, refresh_interval=REFRESH_INTERVAL,
+               chain_file=None, write_chain_file=True):
+    app = web.Application(client_max_size=MAX_UPLOAD_SIZE)
+    app[EXECUTOR_KEY] = ThreadPoolExecutor(max_workers=workers)
+    if chain_file:
+        if write_chain_file or not os.path.exists(chain_file):
+            chain_mmap.sync_chain_file(chain, chain_file)
+        app[CHAIN_FILE_KEY] = chain_mmap.ChainFile(chain_file)
+
+        def refresh():
+            if write_chain_file:
+                chain_mmap.sync_chain_file(chain, chain_file)
+            app[CHAIN_FILE_KEY].refresh()
+    else:
+        app[CHAIN_KEY] = chain_cache.get_shared_chain(chain)
+        refresh = app[CHAIN_KEY].refresh
+
+    async def lifecycle(app):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(app[EXECUTOR_KEY], refresh)
+        refresher = None
+        if refresh_interval:
+            refresher = asyncio.create_task(refresh_chain(app, refresh_interval, refresh))
+        yield
+        if refresher is not None:
+            refresher.cancel()
+        app[EXECUTOR_KEY].shutdown(wait=False)
+
+    app.cleanup_ctx.append(lifecycle)
+    app.router.add_get("/verify/{barcode_hash}", verify_by_hash)
+    app.router.add_post("/verify", verify_upload)
+    app.router.add_get("/health", health)
+    return app
+
+
+def serve(args, chain_file, write_chain_file):
+    app = create_app(args.chain, args.workers, args.refresh, chain_file, write_chain_file)
+    web.run_app(app, host=args.host, port=args.port, backlog=4096, reuse_port=args.processes > 1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve barcode verification over a non-blocking HTTP API.")
+    parser.add_argument("--chain", default=DEFAULT_CHAIN, help="blockchain JSON file (its configured store is used)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=None, help="hashing threads")
+    parser.add_argument("--refresh", type=float, default=REFRESH_INTERVAL,
+                        help="seconds between checks for new blocks (0 disables them)")
+    parser.add_argument("--chain-file", nargs="?", const="", default=None,
+                        help="serve from the memory-mapped chain file (default path: <chain>.chain)")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="worker processes sharing the port (requires --chain-file)")
+    args = parser.parse_args(argv)
+
+    chain_file = None
+    if args.chain_file is not None:
+        chain_file = args.chain_file or chain_mmap.chain_file_for(args.chain)
+        chain_mmap.sync_chain_file(args.chain, chain_file)
+    elif args.processes > 1:
+        parser.error("--processes needs --chain-file")
+
+    if args.processes <= 1:
+        serve(args, chain_file, True)
+        return 0
+    workers = [multiprocessing.Process(target=serve, args=(args, chain_file, number == 0))
+               for number in range(args.processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())